@@ -0,0 +1,96 @@
+from log import *
+import glob
+
+
+class Backlight(Log):
+    is_hardware = False  # Dims the screen itself (no software overlay needed)
+
+    def __init__(self, name: str):
+        """
+        Base class of brightness backends used by Ui.set_brightness()
+        :param name: Instance name
+        """
+        super().__init__(name)
+
+    def set(self, brightness: int) -> None:
+        """
+        To be overwritten by subclasses.
+        :param brightness: Brightness from 0 to 255
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        To be overwritten by subclasses.
+        Called when the backend is replaced or the Ui closes
+        """
+        pass
+
+
+class SoftwareBacklight(Backlight):
+    def __init__(self):
+        """
+        Fallback backend, the Ui dims the screen by drawing a translucent overlay
+        """
+        super().__init__('Backlight (software)')
+
+
+class SysfsBacklight(Backlight):
+    is_hardware = True
+    _Root = '/sys/class/backlight'
+
+    def __init__(self, device: str):
+        """
+        Sets the brightness through the kernel backlight driver
+        :param device: Folder of the backlight device (eg. "/sys/class/backlight/rpi_backlight")
+        """
+        super().__init__('Backlight (sysfs)')
+        self._path = os.path.join(device, 'brightness')
+        with open(os.path.join(device, 'max_brightness'), 'r') as file:
+            self._max_brightness = int(file.read())
+        self._value = None  # Last value written
+
+    @staticmethod
+    def find(root: str = _Root) -> str or None:
+        """
+        :param root: Folder containing backlight devices
+        :return: The first backlight device that can be written to, or None
+        """
+        for device in sorted(glob.glob(os.path.join(root, '*'))):
+            if os.access(os.path.join(device, 'brightness'), os.W_OK):
+                return device
+        return None
+
+    def set(self, brightness: int) -> None:
+        value = round(max(min(brightness, 255), 0) / 255 * self._max_brightness)
+        if value != self._value:  # Avoid rewriting the same value
+            with open(self._path, 'w') as file:
+                file.write(str(value))
+            self._value = value
+
+
+class GpioPwmBacklight(Backlight):
+    is_hardware = True
+
+    def __init__(self, pin: int, frequency=1000):
+        """
+        Sets the brightness by driving the backlight enable pin with PWM
+        :param pin: The BCM pin of the backlight
+        :param frequency: PWM frequency (Hz)
+        """
+        super().__init__('Backlight (gpio pwm)')
+        import RPi.GPIO as GPIO  # Only available on a Raspberry Pi
+        self._gpio = GPIO
+        self._pin = pin
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin, GPIO.OUT)
+        self._pwm = GPIO.PWM(pin, frequency)
+        self._pwm.start(100)
+
+    def set(self, brightness: int) -> None:
+        self._pwm.ChangeDutyCycle(max(min(brightness, 255), 0) / 255 * 100)
+
+    def close(self) -> None:
+        self._pwm.stop()
+        self._gpio.cleanup(self._pin)
@@ -0,0 +1,336 @@
+"""
+Headless benchmark of the main loop with the Spotify window.
+Runs Miniplayer with the SDL dummy video driver, a fake MQTT client and a local HTTP server standing in for Node-RED,
+then prints frame statistics for each scenario as JSON.
+
+    python benchmark.py [--frames 600] [--scenario steady] [--output results.json]
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # Before pygame is imported
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')  # Keep the output machine readable
+
+from miniplayer import *
+from scheduler import FrameMode
+from webclient import _import_requests
+from windows.spotify import SpotifyWindow
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import defaultdict
+import argparse
+import copy
+import io
+import json
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import plugins
+import windows
+
+try:
+    import resource  # Peak memory (not available on Windows)
+except ImportError:
+    resource = None
+
+
+class FakeMqtt:
+    def __init__(self, *args, **kwargs):
+        """
+        Stands in for MqttClient, messages are injected with send() and handled by process() like the real client
+        """
+        self.topics = defaultdict(list)  # { 'topic': [response()] }
+        self._inbox = []
+        self.sent = 0
+
+    def send(self, topic: str, payload) -> None:
+        msg = type('Message', (), {})()
+        msg.topic, msg.payload = topic, json.dumps(payload).encode()
+        self._inbox.append(msg)
+
+    def process(self) -> int:
+        messages, self._inbox = self._inbox, []
+        for msg in messages:
+            for response in list(self.topics.get(msg.topic, ())):
+                response(self, None, msg)
+        return len(messages)
+
+    def sub(self, topic: str or tuple, response, policy=None) -> None:
+        for t in [topic] if type(topic) is str else topic:
+            self.topics[t].append(response)
+
+    def unsub(self, topic: str or tuple, response=None) -> None:
+        for t in [topic] if type(topic) is str else topic:
+            self.topics.pop(t, None)
+
+    def pub(self, topic: str, payload, collapse=False) -> None:
+        self.sent += 1
+
+    def get_id(self) -> str:
+        return 'benchmark'
+
+    def get_connected(self) -> bool:
+        return True
+
+    def get_deadline(self) -> None:
+        return None
+
+    def connect(self): pass
+    def start_replay(self): pass
+    def disconnect(self): pass
+    def flush(self): return 0
+    def set_publish(self, *args, **kwargs): pass
+    def get_stats(self): return {}
+
+
+class StandInServer:
+    _Cover_size = 640
+
+    def __init__(self, playlists=200):
+        """
+        Local HTTP server answering the Node-RED endpoints used by the Spotify window and serving album covers
+        :param playlists: Amount of playlists in the library
+        """
+        self._covers = {}  # Encoded covers -> { index: png bytes }
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path.startswith('/cover/'):
+                    self._send(server.get_cover(int(path.split('/')[2])), 'image/png')
+                elif path == '/endpoint/spotify/liked':
+                    self._send(b'[true]', 'application/json')
+                elif path == '/endpoint/spotify/playlist':
+                    self._send(server.library, 'application/json')
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        self.library = json.dumps({'items': [{'name': 'Playlist %d' % i, 'uri': 'spotify:playlist:%d' % i,
+                                              'images': [{'url': self.cover_url(1000 + i)}]}
+                                             for i in range(playlists)]}).encode()
+        threading.Thread(name='Benchmark server', target=self._server.serve_forever, daemon=True).start()
+
+    def cover_url(self, index: int) -> str:
+        return self.url + '/cover/%d' % index
+
+    def get_cover(self, index: int) -> bytes:
+        with self._lock:
+            if index not in self._covers:
+                surf = pg.surface.Surface((self._Cover_size, self._Cover_size))
+                surf.fill(((index * 37) % 256, (index * 91) % 256, (index * 53) % 256))
+                pg.draw.circle(surf, (255, 255, 255), surf.get_rect().center, self._Cover_size // 3)
+                data = io.BytesIO()
+                pg.image.save(surf, data, 'cover.png')
+                self._covers[index] = data.getvalue()
+            return self._covers[index]
+
+    def close(self) -> None:
+        self._server.shutdown()
+
+
+class NoWaitScheduler(FrameScheduler):
+    def wait(self, deadlines: list[int or None]) -> list[pg.event.Event]:
+        """
+        Draws frames back to back, so the benchmark measures the work of a frame rather than sleeping
+        """
+        self.mode = FrameMode.Burst
+        return pg.event.get()
+
+
+class Benchmark:
+    _Warmup = 30  # Frames run before measuring each scenario
+    _Mqtt_response = SpotifyWindow._mqtt_response
+
+    def __init__(self, server: StandInServer):
+        self._server = server
+        self._mqtt = None
+        self._player = None
+        self._window = None
+        self._track = 0
+        self._state = None
+
+    def start(self) -> None:
+        import miniplayer
+        miniplayer.MqttClient = FakeMqtt  # Created by Miniplayer
+        windows.__all__ = ['spotify']  # Only the window being measured
+        plugins.__all__ = []  # Plugins depend on device hardware
+        Ui._Backlight_detect = False  # Never write to the backlight of the machine running the benchmark
+        SpotifyWindow._nodered_url = self._server.url + '/endpoint'
+        SpotifyWindow._cache_folder = tempfile.mkdtemp(prefix='miniplayer-benchmark-')  # Start with cold caches
+        _import_requests()  # Normally imported by the first request, keep it out of the measured frames
+
+        self._player = Miniplayer()
+        self._player._Scheduler = NoWaitScheduler()
+        self._mqtt = self._player._Mqtt
+        self._window = self._player._windows[self._player.active_window_name]
+
+    def end(self) -> None:
+        self._player.end()
+        shutil.rmtree(SpotifyWindow._cache_folder, ignore_errors=True)
+
+    def run(self, name: str, frames: int) -> dict:
+        """
+        :param name: Scenario name (a method called _scenario_<name> with the frame index every frame)
+        :param frames: Frames to measure
+        :return: Results of the scenario
+        """
+        scenario = getattr(self, '_scenario_' + name)
+        self._reset()
+        for frame in range(self._Warmup):
+            scenario(-self._Warmup + frame)
+            self._player.update()
+
+        times = []
+        start = time.perf_counter()
+        for frame in range(frames):
+            scenario(frame)
+            timestamp = time.perf_counter()
+            self._player.update()
+            times.append((time.perf_counter() - timestamp) * 1000)
+        duration = time.perf_counter() - start
+
+        # Allocations are measured in a separate pass, tracing slows every frame down
+        allocations = []
+        tracemalloc.start()
+        for frame in range(frames, frames + max(frames // 4, 1)):
+            scenario(frame)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            self._player.update()
+            allocations.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+
+        times.sort()
+        allocations.sort()
+        return {
+            'scenario': name,
+            'frames': frames,
+            'fps': round(frames / duration, 1),
+            'frame_ms': {'mean': round(sum(times) / len(times), 3), 'p50': self._percentile(times, 50),
+                         'p95': self._percentile(times, 95), 'p99': self._percentile(times, 99),
+                         'max': round(times[-1], 3)},
+            'alloc_bytes_per_frame': {'p50': self._percentile(allocations, 50),
+                                      'p95': self._percentile(allocations, 95), 'max': allocations[-1]},
+            'peak_rss_kb': self._peak_rss(),
+        }
+
+    def _reset(self) -> None:
+        self._window._view_playlists = False
+        self._track = 0
+        self._state = {
+            'device': {'id': 'benchmark', 'name': 'Benchmark', 'type': 'Computer', 'supports_volume': True,
+                       'volume_percent': 50},
+            'shuffle_state': False, 'repeat_state': 'off',
+            'context': {'type': 'playlist', 'uri': 'spotify:playlist:3'},
+            'progress_ms': 0,
+            'item': {'album': {'images': [{'url': self._server.cover_url(0)}], 'name': 'Benchmark Album'},
+                     'artists': [{'name': 'First Artist'}, {'name': 'Second Artist'}], 'duration_ms': 215000,
+                     'explicit': False, 'id': 'track0', 'name': 'Benchmark Song'},
+            'currently_playing_type': 'track', 'is_playing': True}
+        self._send()
+
+    def _send(self) -> None:
+        self._mqtt.send(self._Mqtt_response, copy.deepcopy(self._state))
+
+    def _next_track(self, cover: int) -> None:
+        self._track += 1
+        self._state['item']['id'] = 'track%d' % self._track
+        self._state['item']['name'] = 'Benchmark Song %d' % self._track
+        self._state['item']['album']['images'][0]['url'] = self._server.cover_url(cover)
+        self._state['progress_ms'] = 0
+        self._send()
+
+    def _scenario_steady(self, frame: int) -> None:  # Playing, one state update a second (at 60 fps)
+        if frame % 60 == 0:
+            self._state['progress_ms'] += 1000
+            self._send()
+
+    def _scenario_skipping(self, frame: int) -> None:  # Skipping tracks every few frames, covers are reused
+        if frame % 4 == 0:
+            self._next_track(self._track % 5)
+
+    def _scenario_covers(self, frame: int) -> None:  # A new album every half second, covers are new
+        if frame % 30 == 0:
+            self._next_track(100 + self._track)
+
+    def _scenario_playlists(self, frame: int) -> None:  # Playlist menu open, scrolling up and down
+        if not self._window._view_playlists and self._window._playlists:
+            self._window._view_playlists = True  # As if the playlist button was pressed
+            self._window._plist_range = range(0)
+        if frame % 90 == 0:
+            self._window._plist_menu.fling(3000 if frame % 180 == 0 else -3000)
+
+    @staticmethod
+    def _percentile(values: list, percent: float) -> float:
+        index = min(int(len(values) * percent / 100), len(values) - 1)
+        return round(values[index], 3)
+
+    @staticmethod
+    def _peak_rss() -> int or None:
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak  # Bytes on macOS, KB on Linux
+
+
+def _fix_asset_paths() -> None:
+    """
+    Asset paths are written with Windows separators, convert them on other systems
+    """
+    if os.sep == '\\':
+        return
+
+    load, font = pg.image.load, pg.font.Font
+    pg.image.load = lambda path, *args: load(path.replace('\\', os.sep) if type(path) is str else path, *args)
+    pg.font.Font = lambda path, size: font(path.replace('\\', os.sep) if type(path) is str else path, size)
+
+
+if __name__ == '__main__':
+    scenarios = ['steady', 'skipping', 'covers', 'playlists']
+    parser = argparse.ArgumentParser(description="Headless benchmark of the Spotify window")
+    parser.add_argument('--frames', type=int, default=600, help="frames measured per scenario")
+    parser.add_argument('--scenario', choices=scenarios, action='append', help="scenario to run (default: all)")
+    parser.add_argument('--output', help="file to write the results to (default: stdout)")
+    args = parser.parse_args()
+
+    Log.set_level(LogLevel.ERR)  # Keep the output machine readable
+    _fix_asset_paths()
+    pg.init()
+
+    server = StandInServer()
+    benchmark = Benchmark(server)
+    benchmark.start()
+    try:
+        results = {'python': sys.version.split()[0], 'pygame': pg.version.ver,
+                   'scenarios': [benchmark.run(name, args.frames) for name in args.scenario or scenarios]}
+    finally:
+        benchmark.end()
+        server.close()
+        pg.quit()
+        Log.close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
@@ -0,0 +1,315 @@
+from log import *
+from collections import OrderedDict
+import pygame as pg
+import threading
+import time
+import hashlib  # To name cache files
+import struct  # To read / write cache file headers
+import json
+import glob
+import mmap
+
+
+class LruCache:
+    def __init__(self, max_size: int, sizeof=None):
+        """
+        Bounded cache which evicts the least recently used items first
+        :param max_size: Maximum total size of all items (item count if sizeof is not given)
+        :param sizeof: Function returning the size of a value (eg. bytes of a surface)
+        """
+        self.max_size = max_size
+        self._sizeof = sizeof if sizeof is not None else (lambda value: 1)
+        self._items = OrderedDict()  # { key: (value, size) } oldest first
+        self._lock = threading.Lock()  # Shared between the main loop and loading threads
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """
+        :param key: The key of the item
+        :param default: Returned if the key is not cached
+        :return: The cached value (marked as recently used)
+        """
+        with self._lock:
+            try:
+                value = self._items[key][0]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        """
+        Adds an item, evicting old items until it fits.
+        Items larger than the whole cache are not stored.
+        :param key: The key of the item
+        :param value: The value to cache
+        """
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            if size > self.max_size:
+                return
+
+            self._items[key] = value, size
+            self.size += size
+            while self.size > self.max_size:
+                self.size -= self._items.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._items.pop(key)
+            except KeyError:
+                return default
+            self.size -= size
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'items': len(self._items), 'size': self.size, 'max_size': self.max_size, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'hit_rate': self.hits / total if total else 0.0}
+
+
+class DiskCache(Log):
+    _HEADER = struct.Struct('<4s4sHHH')  # Magic, pixel format, width, height, alpha
+    _MAGIC = b'MPSC'
+    _NO_ALPHA = 0xFFFF
+
+    def __init__(self, name: str, folder: str, max_bytes: int):
+        """
+        Content-addressed cache of raw surfaces on disk, evicts the least recently used entries first.
+        Surfaces are stored as raw pixels so loading is a single copy from a memory map (no decoding or scaling).
+        :param name: Instance name
+        :param folder: Folder to store the cache in
+        :param max_bytes: Maximum size of the cache on disk
+        """
+        super().__init__(name)
+        self.max_bytes = max_bytes
+        self._folder = folder
+        self._index_path = os.path.join(folder, 'index.json')
+        self._index = OrderedDict()  # { digest: bytes } oldest first
+        self._lock = threading.Lock()  # Used by loading threads
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with open(self._index_path, 'r') as file:
+                self._index.update(json.load(file))
+            self.size = sum(self._index.values())
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            self.handle(err, trace=False)
+            self.log("Could not read cache index, starting empty", LogLevel.WRN, data="path: " + self._index_path)
+
+    @staticmethod
+    def digest(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key: str, variants: tuple[str, ...]) -> tuple[pg.surface.Surface, ...] or None:
+        """
+        :param key: The key of the entry (eg. a url)
+        :param variants: Names of the surfaces stored under the key
+        :return: The surfaces in the order of variants, or None if not cached
+        """
+        digest = self.digest(key)
+        with self._lock:
+            if digest not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(digest)
+
+        try:
+            surfaces = tuple(self._read(self._path(digest, variant)) for variant in variants)
+        except Exception as err:  # Missing or corrupt, drop the entry
+            self.handle(err, trace=False)
+            self._remove(digest)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return surfaces
+
+    def put(self, key: str, surfaces: dict[str, pg.surface.Surface]) -> None:
+        """
+        :param key: The key of the entry (eg. a url)
+        :param surfaces: The surfaces to store -> { variant: surface }
+        """
+        digest = self.digest(key)
+        try:
+            size = sum(self._write(self._path(digest, variant), surf) for variant, surf in surfaces.items())
+        except Exception as err:
+            self.handle(err, trace=False)
+            self.log("Failed to write to cache", LogLevel.WRN, data="key: " + key)
+            return
+
+        with self._lock:
+            self.size += size - self._index.pop(digest, 0)
+            self._index[digest] = size
+            while self.size > self.max_bytes and len(self._index) > 1:  # Evict oldest
+                old_digest, old_size = self._index.popitem(last=False)
+                self.size -= old_size
+                self._delete_files(old_digest)
+        self.save()
+
+    def save(self) -> None:
+        """
+        Writes the index (including recent use) to disk
+        """
+        with self._lock:
+            index = dict(self._index)
+        try:
+            with open(self._index_path, 'w') as file:
+                json.dump(index, file)
+        except Exception as err:
+            self.handle(err, trace=False)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'entries': len(self._index), 'size': self.size, 'max_size': self.max_bytes, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+    def _path(self, digest: str, variant: str) -> str:
+        return os.path.join(self._folder, digest + '_' + variant + '.raw')
+
+    def _remove(self, digest: str) -> None:
+        with self._lock:
+            self.size -= self._index.pop(digest, 0)
+        self._delete_files(digest)
+
+    def _delete_files(self, digest: str) -> None:
+        for path in glob.glob(os.path.join(self._folder, digest + '_*.raw')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _write(self, path: str, surf: pg.surface.Surface) -> int:
+        pixel_format = 'RGBA' if surf.get_flags() & pg.SRCALPHA else 'RGB'
+        alpha = surf.get_alpha()
+        data = pg.image.tobytes(surf, pixel_format)
+        with open(path, 'wb') as file:
+            file.write(self._HEADER.pack(self._MAGIC, pixel_format.encode().ljust(4), *surf.get_size(),
+                                         self._NO_ALPHA if alpha is None else alpha))
+            file.write(data)
+        return self._HEADER.size + len(data)
+
+    def _read(self, path: str) -> pg.surface.Surface:
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, pixel_format, width, height, alpha = self._HEADER.unpack_from(data)
+            if magic != self._MAGIC:
+                raise ValueError("Not a cache file: " + path)
+
+            pixels = memoryview(data)[self._HEADER.size:]
+            try:
+                surf = pg.image.frombuffer(pixels, (width, height), pixel_format.decode().strip()).copy()
+            finally:
+                pixels.release()  # Release before the memory map closes
+
+        if alpha != self._NO_ALPHA:
+            surf.set_alpha(alpha)
+        return surf
+
+
+class TtlCache(Log):
+    def __init__(self, name: str, ttl: float, path: str = None):
+        """
+        Cache of small values which expire after a time to live.
+        Can be saved to and loaded from a JSON snapshot, so keys and values must be JSON types.
+        :param name: Instance name
+        :param ttl: Time before values expire (s)
+        :param path: File to save / load the snapshot (None = memory only)
+        """
+        super().__init__(name)
+        self.ttl = ttl
+        self._path = path
+        self._items = {}  # { key: (value, expiry timestamp) }
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            self.load()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expiry = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expiry <= time.time():  # Expired
+                del self._items[key]
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value, time.time() + self.ttl
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def load(self) -> None:
+        try:
+            with open(self._path, 'r') as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as err:
+            self.handle(err, trace=False)
+            self.log("Could not read snapshot", LogLevel.WRN, data="path: " + self._path)
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, (value, expiry) in snapshot.items():
+                if expiry > now:  # Drop expired values
+                    self._items[key] = value, expiry
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+
+        now = time.time()
+        with self._lock:
+            snapshot = {key: item for key, item in self._items.items() if item[1] > now}
+        try:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            with open(self._path, 'w') as file:
+                json.dump(snapshot, file)
+        except Exception as err:
+            self.handle(err, trace=False)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'items': len(self._items), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
@@ -0,0 +1,191 @@
+from log import *
+from scheduler import FrameScheduler
+from webclient import HttpClient
+from collections import OrderedDict
+import threading
+
+
+class ImageLoader(Log):
+    _CHUNK_SIZE = 64 * 1024  # Download size between checks for newer requests (bytes)
+
+    def __init__(self, name: str, http: HttpClient):
+        """
+        Downloads and decodes images on a background thread.
+        Only the latest request is loaded, older requests are dropped as soon as a newer one arrives.
+        :param name: Instance name (also the thread name)
+        :param http: The shared HTTP client to download with
+        """
+        super().__init__(name)
+        self._http = http
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._generation = 0  # Incremented by every request, older generations are stale
+        self._request = None  # Waiting request -> (generation, key, url, process, cached)
+        self._result = None  # Finished request -> (key, result)
+
+        self._thread = threading.Thread(name=name, target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, key, url: str, process, cached=None) -> None:
+        """
+        Loads an image, replacing any request that has not finished yet
+        :param key: Identifies the result (eg. the url)
+        :param url: The image to download
+        :param process: Called on the loading thread with the key and downloaded bytes, returns the result
+        :param cached: Called on the loading thread first, returns the result or None to download
+        """
+        with self._lock:
+            self._generation += 1
+            self._request = self._generation, key, url, process, cached
+        self._wake.set()
+
+    def cancel(self) -> None:
+        """
+        Drops the waiting request, any result not yet collected and the request being loaded
+        """
+        with self._lock:
+            self._generation += 1
+            self._request = None
+            self._result = None
+
+    def poll(self) -> tuple or None:
+        """
+        Collects the latest finished image, call from the main loop
+        :return: (key, result) or None if nothing has finished
+        """
+        with self._lock:
+            result, self._result = self._result, None
+        return result
+
+    def _is_stale(self, generation: int) -> bool:
+        return generation != self._generation
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+
+            with self._lock:
+                request, self._request = self._request, None
+            if request is None:
+                continue
+
+            generation, key, url, process, cached = request
+            try:
+                result = cached(key) if cached is not None else None
+                if result is None:  # Not cached, download
+                    data = self._download(url, generation)
+                    if data is None:  # Superseded whilst downloading
+                        self.log("Dropped stale image", LogLevel.INF, data="url: " + url)
+                        continue
+
+                    result = process(key, data)  # Decode / scale
+
+            except Exception as err:
+                self.handle(err, trace=False)
+                self.log("Failed to load image", LogLevel.WRN, data="url: " + url)
+                continue
+
+            with self._lock:
+                if self._is_stale(generation):  # Superseded whilst decoding
+                    self.log("Dropped stale image", LogLevel.INF, data="url: " + url)
+                    continue
+                self._result = key, result  # Hand over to the main loop in one step
+            FrameScheduler.wake()
+
+    def _download(self, url: str, generation: int) -> bytes or None:
+        with self._http.get(url, stream=True) as response:
+            response.raise_for_status()
+
+            data = bytearray()
+            for chunk in response.iter_content(self._CHUNK_SIZE):
+                if self._is_stale(generation):
+                    return None
+                data += chunk
+        return bytes(data)
+
+
+class ImageQueue(Log):
+    def __init__(self, name: str, http: HttpClient, max_pending=32):
+        """
+        Downloads and decodes many small images on a background thread, newest requests first.
+        Requests that are no longer needed can be dropped with retain().
+        :param name: Instance name (also the thread name)
+        :param http: The shared HTTP client to download with
+        :param max_pending: Maximum waiting requests, the oldest are dropped
+        """
+        super().__init__(name)
+        self._http = http
+        self._max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = OrderedDict()  # Waiting requests -> { key: (url, process) } newest last
+        self._loading = None  # Key of the request being loaded
+        self._results = []  # Finished requests -> [(key, result)]
+
+        self._thread = threading.Thread(name=name, target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, key, url: str, process) -> None:
+        """
+        :param key: Identifies the result
+        :param url: The image to download
+        :param process: Called on the loading thread with the key and downloaded bytes, returns the result
+        """
+        with self._lock:
+            if key == self._loading:
+                return
+            self._pending[key] = url, process
+            self._pending.move_to_end(key)
+            while len(self._pending) > self._max_pending:
+                self._pending.popitem(last=False)
+        self._wake.set()
+
+    def is_pending(self, key) -> bool:
+        return key in self._pending or key == self._loading
+
+    def retain(self, keys) -> None:
+        """
+        Drops waiting requests that are not in keys
+        :param keys: The keys that are still needed
+        """
+        with self._lock:
+            for key in [key for key in self._pending if key not in keys]:
+                del self._pending[key]
+
+    def poll(self) -> list[tuple]:
+        """
+        Collects finished images, call from the main loop
+        :return: [(key, result)]
+        """
+        with self._lock:
+            results, self._results = self._results, []
+        return results
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._pending:
+                    self._wake.clear()
+                    continue
+                key, (url, process) = self._pending.popitem(last=True)  # Newest first
+                self._loading = key
+
+            try:
+                response = self._http.get(url)
+                response.raise_for_status()
+                result = process(key, response.content)
+            except Exception as err:
+                self.handle(err, trace=False)
+                self.log("Failed to load image", LogLevel.WRN, data="url: " + url)
+                result = None
+
+            with self._lock:
+                self._loading = None
+                if result is not None:
+                    self._results.append((key, result))
+            if result is not None:
+                FrameScheduler.wake()
@@ -1,13 +1,20 @@
 from datetime import datetime
+from collections import deque
 from enum import IntEnum
 import os
+import sys
+import time
+import queue
+import threading
 import traceback
+import atexit
 
 
 class LogLevel(IntEnum):
     ERR = 2  # Error - The program is attempting to fix an issue
     WRN = 3  # Warning - Encountered an issue but fine to continue
     INF = 4  # Info - Status updates
+    DBG = 5  # Debug - Frequent messages (eg. every MQTT publish)
 
 class Log:
     _Init = False
@@ -16,9 +23,21 @@ class Log:
     _File = None
 
     _Save_to_file = False  # Save the latest logs to disk?
-    _Live_logging = False  # Save to file while running (slow, only for debug)
+    _Live_logging = False  # Flush the file after every write (only for debug)
     _Level = LogLevel['INF']  # Filter by severity
 
+    _Max_bytes = 1024 * 1024  # Size to rotate the log file at
+    _Backups = 3  # Rotated log files to keep (.1 is the newest)
+    _Ring = deque(maxlen=500)  # Recent records, written to disk by dump() on a crash
+
+    _Queue = queue.SimpleQueue()  # Records waiting for the writer thread
+    _Writer = None  # Writer thread, formats and outputs records in batches
+    _Writer_lock = threading.Lock()
+    _STOP = None  # Queued to stop the writer thread
+    _Exit_timeout = 2  # Time the writer is given to write queued records when the program exits (s)
+    _Limits = {}  # Rate limited call sites -> { (code, line): [window start, calls] }
+    _Limits_lock = threading.Lock()  # Call sites are logged from several threads
+
     def __init__(self, name: str) -> None:
         """
         Constructor
@@ -26,35 +45,41 @@ class Log:
         """
         self.name = name
 
-        if not self._Init and self._Save_to_file:  # Run first time init
+        if not Log._Init and Log._Save_to_file:  # Run first time init
+            Log._Init = True
             self.open()
-            self._Init = True
 
-    def log(self, msg: str, level: LogLevel, data=None) -> None:
+    def log(self, msg: str, level: LogLevel, data=None, args=(), every: float = None) -> None:
         """
-        Logs a message
-        :param msg: The message to save
+        Logs a message.
+        Only queues the record, formatting and writing is done by the writer thread.
+        Nothing is built unless the message passes the level filter, so pass values through args or a callable
+        (eg. self.log("Playlists: %d", LogLevel.DBG, args=(len(self._playlists),)) or data=lambda: str(...)).
+        args are formatted later on the writer thread, so only pass immutable values (numbers, strings, tuples),
+        never lists or dicts that another thread may change. The callable is run straight away.
+        :param msg: The message to save, formatted with args ("%s" style) if given
         :param level: The message severity
-        :param data: String of data to include
+        :param data: String of data to include, or a function returning it
+        :param args: Values to format msg with
+        :param every: Log this call site at most once per this many seconds, counting the calls skipped
         """
-        try:
-            if self._Level.value >= level:  # Filter priority
-                msg = (f"[{datetime.now().strftime('%X')}][{level.name}] {self.name} -> "
-                       f"{msg}{f' ({data})' if data else ''}")  # Format message
-                print(msg)  # Output message to console
-                if self._Save_to_file:
-                    if self._Live_logging:  # Save log to file on each message (slow!)
-                        with open(self._Path, "a") as file:
-                            file.write(msg + '\n')
-                    else:  # File is already open (efficient mode)
-                        if not self._File.closed:
-                            self._File.write(msg + '\n')
-                        else:
-                            self._Save_to_file = False
-                            self.log("Attempted log to closed file", LogLevel.ERR, "path: " + self._Path)
-
-        except Exception as e:  # If logging failed
-            self.handle(e)
+        if self._Level.value >= level:  # Filter priority
+            if every is not None:
+                frame = sys._getframe(1)
+                summary = Log._limit((frame.f_code, frame.f_lineno), every)
+                if summary is None:  # Logged recently
+                    return
+                if summary:
+                    data = (data() if callable(data) else data) or ''
+                    data = data + (', ' if data else '') + summary
+            if callable(data):
+                data = data()
+
+            record = time.time(), level, self.name, msg, data, args
+            Log._Ring.append(record)
+            if Log._Writer is None:
+                Log._start()
+            Log._Queue.put(record)
 
     def handle(self, err: Exception or BaseException, data=None, level=LogLevel.ERR, trace=True) -> None:
         """
@@ -72,6 +97,8 @@ class Log:
 
         if trace:  # Toggle traceback
             self.log(msg + traceback.format_exc(), level, data)
+        else:
+            self.log(msg, level, data)
 
     @staticmethod
     def set_level(level: LogLevel) -> None:
@@ -79,8 +106,40 @@ class Log:
         Sets a new log level
         :param level: New logging level
         """
+        Log._Level = level
         Log("Log").log("Set new log level", LogLevel.INF, "level: " + level.name)
-        Log._Log_level = level
+
+    @staticmethod
+    def format(record: tuple) -> str:
+        timestamp, level, name, msg, data, args = record
+        if args:
+            try:
+                msg = msg % args
+            except Exception as e:  # Wrong arguments should not lose the message
+                msg = f"{msg} {args} (format failed: {e})"
+        return (f"[{datetime.fromtimestamp(timestamp).strftime('%X')}][{level.name}] {name} -> "
+                f"{msg}{f' ({data})' if data else ''}")  # Format message
+
+    @staticmethod
+    def dump(path: str = None) -> str or None:
+        """
+        Writes the most recent records to disk, call when crashing.
+        Runs on the calling thread so it does not depend on the writer thread.
+        :param path: File to write to (defaults to a crash file in the log folder)
+        :return: The path written to, or None if it failed
+        """
+        if path is None:
+            path = Log._Folder + datetime.now().strftime("crash-%y-%m-%d-%H%M%S.log")
+        try:
+            os.makedirs(Log._Folder, exist_ok=True)
+            with open(path, 'w') as file:
+                file.write('\n'.join(Log.format(record) for record in list(Log._Ring)) + '\n')
+        except Exception as e:
+            print(f"Failed to write crash log to {path} ({e})", file=sys.stderr)
+            return None
+
+        print(f"[{datetime.now().strftime('%X')}][ERR][Log] -> Wrote recent logs to {path}", file=sys.stderr)
+        return path
 
     @staticmethod
     def open():
@@ -99,23 +158,112 @@ class Log:
             Log("Log").handle(e, "path: " + Log._Path)
 
         if Log._File is not None:
+            Log._Init = True
             Log._Save_to_file = True
             Log._File.write(f"\n[{datetime.now().strftime('%x %X')}][INFO][Logger] -> "
                              f"*** New instance ***\n")
 
     @staticmethod
     def close():
+        Log._stop()  # Write everything still queued
+
         if Log._Save_to_file:
-            if Log._Live_logging:
-                with open(Log._Path, "a") as log_file:
-                    log_file.write(f"[{datetime.now().strftime('%x %X')}][INF][Log] -> "
-                                   f"*** End instance ***\n")
-            else:
-                if not Log._File.closed:
-                    Log._File.write(f"[{datetime.now().strftime('%x %X')}][INF][Log] -> "
-                                    f"*** End instance ***\n")
-                    Log._File.close()
+            if not Log._File.closed:
+                Log._File.write(f"[{datetime.now().strftime('%x %X')}][INF][Log] -> "
+                                f"*** End instance ***\n")
+                Log._File.close()
 
             Log._Save_to_file = False
             print(f"[{datetime.now().strftime('%x %X')}][INF][Log] -> "
                   f"Closed the current log file at {Log._Path}\n")
+
+    @staticmethod
+    def _limit(site: tuple, every: float) -> str or None:
+        """
+        :return: None if the call site was logged in the last every seconds,
+         otherwise a summary of the calls skipped since it was last logged ('' if none were)
+        """
+        now = time.monotonic()
+        with Log._Limits_lock:
+            limit = Log._Limits.get(site)
+            if limit is None:
+                Log._Limits[site] = [now, 1]
+                return ''
+
+            if now - limit[0] < every:
+                limit[1] += 1
+                return None
+
+            summary = f"logged 1 of {limit[1]} in the last {now - limit[0]:.3g}s" if limit[1] > 1 else ''
+            limit[0], limit[1] = now, 1
+            return summary
+
+    @staticmethod
+    def _start() -> None:
+        with Log._Writer_lock:
+            if Log._Writer is None:
+                Log._Writer = threading.Thread(name='Log', target=Log._run, daemon=True)
+                Log._Writer.start()
+
+    @staticmethod
+    def _stop(timeout: float = None) -> None:
+        """
+        Stops the writer thread once it has written every queued record
+        :param timeout: Maximum time to wait for the writer (s), None waits until it finishes
+        """
+        with Log._Writer_lock:
+            if Log._Writer is not None:
+                Log._Queue.put(Log._STOP)
+                Log._Writer.join(timeout)
+                Log._Writer = None
+
+    @staticmethod
+    def _exit() -> None:
+        """
+        Run when the program exits, the writer is a daemon thread so records still queued would be lost
+        """
+        Log._stop(Log._Exit_timeout)
+        if Log._Save_to_file and not Log._File.closed:
+            Log._File.flush()
+
+    @staticmethod
+    def _run() -> None:
+        while True:
+            records = [Log._Queue.get()]  # Wait for a record, then take everything queued (one write per batch)
+            try:
+                while True:
+                    records.append(Log._Queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            stop = Log._STOP in records
+            lines = '\n'.join(Log.format(record) for record in records if record is not Log._STOP)
+            if lines:
+                try:
+                    print(lines)  # Output messages to console
+                    if Log._Save_to_file and not Log._File.closed:
+                        Log._File.write(lines + '\n')
+                        if Log._Live_logging:
+                            Log._File.flush()
+                        if Log._File.tell() >= Log._Max_bytes:
+                            Log._rotate()
+                except Exception as e:  # Logging must not stop the writer
+                    print(f"Failed to write logs ({e})", file=sys.stderr)
+
+            if stop:
+                return
+
+    @staticmethod
+    def _rotate() -> None:
+        Log._File.close()
+        for index in range(Log._Backups - 1, 0, -1):  # Shift older files up, the oldest is overwritten
+            if os.path.exists(f"{Log._Path}.{index}"):
+                os.replace(f"{Log._Path}.{index}", f"{Log._Path}.{index + 1}")
+        if Log._Backups > 0:
+            os.replace(Log._Path, Log._Path + '.1')
+        else:
+            os.remove(Log._Path)
+        Log._File = open(Log._Path, 'a')
+
+
+atexit.register(Log._exit)
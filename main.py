@@ -1,16 +1,30 @@
 ﻿from miniplayer import *
+import argparse
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Miniplayer V3")
+    parser.add_argument('--simulate', metavar='TRACE', help="replay a recorded MQTT trace instead of connecting")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed of --simulate (0 = as fast as possible)")
+    parser.add_argument('--record', metavar='TRACE', help="record received MQTT messages to a trace file")
+    parser.add_argument('--backlight', action='store_true',
+                        help="dim the display with its kernel backlight driver (/sys/class/backlight) if found")
+    args = parser.parse_args()
+    Ui._Backlight_detect = args.backlight
+
     pg.init()
-    player = Miniplayer()
+    player = None
 
     try:
+        player = Miniplayer(simulate=args.simulate, speed=args.speed, record=args.record)
         while True:
             player.update()
     except KeyboardInterrupt:
         pass
     except Exception as e:
         Log("Main").handle(e)
+        Log.dump()  # Keep the logs leading up to the crash
     finally:
-        player.end()
+        if player is not None:  # Failed to start otherwise
+            player.end()
         pg.quit()
+        Log.close()  # Write any logs still queued
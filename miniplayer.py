@@ -1,55 +1,64 @@
 ﻿from uuid import getnode as get_mac  # Used to set MQTT username as MAC address
 
+from concurrent.futures import Future, wait  # Windows are built in the background
 import importlib  # Used to import windows dynamically
+import threading
+import os
 import windows  # Window subdirectory
 import plugins  # Plugin subdirectory
 
 from window import *
 from plugin import *
+from profiler import Profiler
+from startup import Startup
 
 class Miniplayer:
-    def __init__(self):
+    def __init__(self, simulate: str = None, speed=1.0, record: str = None):
+        """
+        :param simulate: Trace file to replay instead of connecting to MQTT
+        :param speed: Replay speed of the trace file (0 = as fast as possible)
+        :param record: Trace file to record received MQTT messages to
+        """
         self._log = Log("Miniplayer")
         self._log.log("Start", LogLevel.INF)
 
-        self._Clock = pg.time.Clock()
+        self._Scheduler = FrameScheduler()
+        self._Profiler = Profiler()  # Frame time overlay, toggled with F3 or MQTT
 
         self._Mqtt = MqttClient(str(hex(get_mac())) + "V3", "homeassistant.local", "mosquitto", "bungeeboy12")
         self._Ui = Ui((1280, 720))
+        self._Http = HttpClient()  # Shared by windows and plugins
 
         timestamp = pg.time.get_ticks()
 
-        # LOAD MQTT
-        self._loading_info("mqtt")
-        self._Mqtt.connect()
-
-        # LOAD PLUGINS
         PluginBase.set_mqtt(self._Mqtt)
         PluginBase.set_ui(self._Ui)
-
+        PluginBase.set_http(self._Http)
+        self._plugin_classes = {}  # Imported plugins -> { 'name': class }
         self._plugins = {}
-        for module_name in plugins.__all__:
-            module = importlib.import_module("plugins." + module_name)
 
-            # Dynamically load plugins from the plugin folder
-            for plugin_name in dir(module):
-                class_ref = getattr(module, plugin_name)
-                if isinstance(class_ref, type) and issubclass(class_ref, PluginBase) and class_ref is not PluginBase:  # Only load subclasses of PluginBase
-                    self.load_plugin(class_ref.__name__.replace("Plugin", ""), class_ref)  # Load plugin (with name)
-
-        # LOAD WINDOWS
         WindowBase.set_mqtt(self._Mqtt)
         WindowBase.set_ui(self._Ui)
-
-        self._windows = {}
-        for module_name in windows.__all__:
-            module = importlib.import_module("windows." + module_name)
-
-            # Dynamically load windows from the window folder that inherits from WindowBase
-            for window_name in dir(module):
-                class_ref = getattr(module, window_name)
-                if isinstance(class_ref, type) and issubclass(class_ref, WindowBase) and class_ref is not WindowBase:  # Only load subclasses of WindowBase
-                    self.load_window(class_ref.__name__.replace("Window", ""), class_ref)  # Load window (with name)
+        WindowBase.set_http(self._Http)
+        self._window_classes = {}  # Registered windows -> { 'name': class }
+        self._window_futures = {}  # Resolved with the window once built -> { 'name': Future }
+        self._windows = {}  # Built windows -> { 'name': window }
+        self._build_lock = threading.Lock()  # Decides whether the preloader or the main loop builds a window
+        self._preloader = None
+        self.active_window_name = None
+
+        # Independent stages run at the same time, the splash screen shows their progress
+        self._progress = None  # Last progress drawn -> (finished, running)
+        startup = Startup()
+        startup.add('mqtt', lambda: self._load_mqtt(simulate, speed, record))
+        startup.add('plugins', self._import_plugins)  # Enabled after startup, on this thread
+        startup.add('windows', self._load_windows)
+        startup.add('first window', self._build_first_window, after='windows')
+        startup.run(self._show_progress)
+
+        # Plugins can change the Ui (eg. the backlight), which is not thread safe
+        for name, class_ref in self._plugin_classes.items():
+            self.load_plugin(name, class_ref)
 
         if timestamp + 1500 >= pg.time.get_ticks():  # Minimum splashscreen 1.5s
             self._Ui.clear_info()
@@ -62,58 +71,196 @@ class Miniplayer:
                     if event.type == pg.QUIT or event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
                         raise KeyboardInterrupt
 
-        # Load and enable first window by default on start
-        self._log.log("Loaded windows: " + str(list(self._windows.keys())), LogLevel.INF)
+        # Enable first window by default on start
+        self._log.log("Registered windows: " + str(list(self._window_classes.keys())), LogLevel.INF)
         self._log.log("Loaded plugins: " + str(list(self._plugins.keys())), LogLevel.INF)
         self._log.log("Enabled plugins: " + str(list(self._plugins.keys())), LogLevel.INF)
-        try:
-            self.active_window_name = list(self._windows.keys())[0]  # Default to first window class
-        except IndexError:  # Error handling for no windows found
+        if self.active_window_name is None:  # Error handling for no windows found
             self._log.log("No windows found!", LogLevel.ERR)
             raise KeyboardInterrupt
-        self._windows[self.active_window_name].start()
+        self._get_window(self.active_window_name).start()
+        self._Mqtt.start_replay()  # When simulating, replay once the first window has subscribed
+        self._log.log("Started", LogLevel.INF, data="time: " + str(pg.time.get_ticks() - timestamp) + "ms")
+
+        # Build the other windows while the first one is running
+        self._preloader = threading.Thread(name='Window preloader', target=self._preload, daemon=True)
+        self._preloader.start()
 
     def load_plugin(self, name: str, plugin: type(PluginBase)):
         self._log.log("Loading plugin: " + name, LogLevel.INF)
-        self._loading_info(name.lower())
         self._plugins[name] = plugin()
         self._plugins[name].enable()  # TODO: Enable plugins via settings (enables all for now), plugin settings?
 
     def load_window(self, name: str, window: type(WindowBase)):
-        self._log.log("Loading window: " + name, LogLevel.INF)
-        self._loading_info(name.lower())
-        self._windows[name] = window()
+        """
+        Registers a window, it is built when first needed or by the preloader
+        """
+        self._log.log("Registered window: " + name, LogLevel.INF)
+        self._window_classes[name] = window
+        self._window_futures[name] = Future()
 
     def set_window(self, window_name: str):  # Stops current window and starts another
+        if not self._window_futures[window_name].done():  # Still being built, show why the window is not changing
+            self._loading_info(window_name.lower())
+
+        try:
+            window = self._get_window(window_name)
+        except Exception as err:  # Stay on the current window
+            self._log.log("Failed to load window", LogLevel.ERR, data="window: " + window_name + ", error: " + str(err))
+            self._Ui.show_info("Failed to load " + window_name.lower(), 'Error')
+            return
+
         self._windows[self.active_window_name].stop()  # Stop current window
         self.active_window_name = window_name  # Update to new window name
-        self._windows[self.active_window_name].start()  # Start new window
+        window.start()  # Start new window
 
     def update(self):
-        self._tick(15)  # FPS
-        for event in pg.event.get():  # Event handling
+        events = self._Scheduler.wait(self._get_deadlines())  # Sleep until something can change
+        self._Profiler.begin()
+        self._Profiler.add('idle', self._Scheduler.idle_ms, frame=False)  # Sleeping is not part of the frame
+        self._Profiler.add('events.pump', self._Scheduler.pump_ms)  # Reading events, timed by the scheduler
+        for event in events:  # Handle events
             if event.type == pg.QUIT or event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
                 raise KeyboardInterrupt
+            if event.type == pg.KEYDOWN and event.key == Profiler._Key:
+                self._Profiler.toggle()
+                self._Profiler.begin()
 
         self._Ui.mouse_pos = pg.mouse.get_pos()
+        self._Profiler.mark('events.dispatch')
 
-        self._Ui.clear()
+        self._Mqtt.process()  # Handle messages received since the last frame
+        self._Mqtt.flush()  # Send publishes that were held back
+        self._Profiler.mark('mqtt')
+
+        if not self._windows[self.active_window_name].is_opaque():  # Window does not cover the whole screen
+            self._Ui.clear()
 
         self._windows[self.active_window_name].update()  # Only update active window
-        for plugin in self._plugins.values(): plugin.update()  # Update all plugins
+        self._Profiler.mark('window.update')
+        for name, plugin in self._plugins.items():  # Update all plugins
+            plugin.update()
+            self._Profiler.mark('plugin.' + name)
 
         self._windows[self.active_window_name].draw()  # Only draw active window
+        self._Profiler.mark('window.draw')
 
+        self._Profiler.draw(self._Ui)
+        self._Profiler.skip()  # Do not count the overlay
         self._display()
+        self._Profiler.mark('display')
+        self._Profiler.end()
 
         self._Ui.prev_mouse_pos = self._Ui.mouse_pos
 
     def end(self):
-        self._windows[self.active_window_name].stop()
+        for future in self._window_futures.values():  # Stop the preloader building any more windows
+            future.cancel()
+        if self.active_window_name in self._windows:
+            self._windows[self.active_window_name].stop()
         self._Mqtt.disconnect()
+        self._Http.close()
+        self._Ui.close()
+        self._log.log("Text cache stats", LogLevel.INF, data=str(Ui._Text.get_stats()))
         Log("Miniplayer").log("Stopped", LogLevel.INF)
         self._windows.clear()
 
+    def _load_mqtt(self, simulate: str or None, speed: float, record: str or None) -> None:
+        if record is not None:
+            self._Mqtt.record(record)
+        if simulate is not None:
+            self._Mqtt.simulate(simulate, speed)
+        self._Mqtt.connect()
+        self._Mqtt.sub(Profiler._mqtt_set, self._Profiler.receive)
+
+    def _import_plugins(self) -> None:
+        for module_name in plugins.__all__:
+            module = importlib.import_module("plugins." + module_name)
+
+            # Dynamically load plugins from the plugin folder
+            for plugin_name in dir(module):
+                class_ref = getattr(module, plugin_name)
+                if isinstance(class_ref, type) and issubclass(class_ref, PluginBase) and class_ref is not PluginBase:  # Only load subclasses of PluginBase
+                    self._plugin_classes[class_ref.__name__.replace("Plugin", "")] = class_ref  # Loaded after startup (with name)
+
+    def _load_windows(self) -> None:
+        for module_name in windows.__all__:
+            module = importlib.import_module("windows." + module_name)
+
+            # Dynamically load windows from the window folder that inherits from WindowBase
+            for window_name in dir(module):
+                class_ref = getattr(module, window_name)
+                if isinstance(class_ref, type) and issubclass(class_ref, WindowBase) and class_ref is not WindowBase:  # Only load subclasses of WindowBase
+                    self.load_window(class_ref.__name__.replace("Window", ""), class_ref)  # Load window (with name)
+
+    def _build_first_window(self) -> None:
+        if self._window_classes:
+            self.active_window_name = list(self._window_classes.keys())[0]  # Default to first window class
+            future = self._window_futures[self.active_window_name]
+            if self._claim(future):
+                self._build(self.active_window_name, future)
+
+    def _show_progress(self, finished: int, total: int, running: list[str]) -> None:
+        for event in pg.event.get():  # Event handling
+            if event.type == pg.QUIT or event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
+                raise KeyboardInterrupt
+
+        if self._progress == (finished, running):  # Nothing new to draw
+            return
+        self._progress = finished, running
+
+        self._Ui.show_info("Loading " + ", ".join(running) if running else "Loaded", 'LBlue', force=True)
+        self._Ui.background(txt=True)
+        self._Ui.bar((300, 14), finished, 0, total, midtop=(self._Ui.Center[0], self._Ui.Center[1] + 110))
+        self._display()
+
+    def _get_window(self, name: str) -> WindowBase:
+        """
+        Builds a window on this thread, or waits for the preloader if it is already building it
+        :return: The built window
+        """
+        future = self._window_futures[name]
+        if self._claim(future):
+            self._build(name, future)
+
+        while not future.done():  # Keep the display responsive while waiting
+            wait([future], timeout=0.05)
+            pg.event.pump()
+        return future.result()
+
+    def _claim(self, future: Future) -> bool:
+        """
+        :return: If the caller should build the window (it has not been started or cancelled)
+        """
+        with self._build_lock:
+            return not future.running() and not future.done() and future.set_running_or_notify_cancel()
+
+    def _build(self, name: str, future: Future) -> None:
+        timestamp = pg.time.get_ticks()
+        try:
+            window = self._window_classes[name]()
+        except Exception as err:
+            self._log.handle(err, data="window: " + name)
+            future.set_exception(err)
+            return
+
+        self._windows[name] = window
+        future.set_result(window)
+        self._log.log("Built window: " + name, LogLevel.INF, data="time: " + str(pg.time.get_ticks() - timestamp) + "ms")
+
+    def _preload(self) -> None:
+        """
+        Builds the registered windows that have not been built yet, runs at a low priority on its own thread
+        """
+        try:  # Lower the priority of this thread only (Linux), the main loop comes first
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):  # Not supported on this system
+            pass
+
+        for name, future in list(self._window_futures.items()):
+            if self._claim(future):
+                self._build(name, future)
+
     def _loading_info(self, window_name: str):
         self._Ui.show_info("Loading " + window_name, 'LBlue', force=True)
         self._Ui.background(txt=True)
@@ -122,8 +269,12 @@ class Miniplayer:
     def _update_mouse(self):
         self._Ui.mouse_pos = pg.mouse.get_pos()
 
-    def _tick(self, fps: int):
-        self._Clock.tick(fps)
+    def _get_deadlines(self) -> list[int or None]:
+        deadlines = [self._Ui.get_info()[2] or None, self._windows[self.active_window_name].get_deadline(),
+                     self._Mqtt.get_deadline()]
+        for plugin in self._plugins.values():
+            deadlines.append(plugin.get_deadline())
+        return deadlines
 
     def _display(self):
         if self._Ui.get_info()[0]:  # If there is a message to be shown
@@ -134,4 +285,8 @@ class Miniplayer:
 
         self._Ui.apply_brightness()
 
-        pg.display.update()
+        damage = self._Ui.get_damage()  # Only upload regions that changed this frame
+        if damage is None:
+            pg.display.update()
+        elif damage:
+            pg.display.update(damage)
@@ -1,12 +1,151 @@
 ﻿from paho.mqtt import client as mqtt
-from pygame import time as time
+from scheduler import FrameScheduler
+from recorder import TraceRecorder, TraceReplayer
 from log import *
+from collections import OrderedDict
+from enum import Enum
+import pygame as pg
+import threading
+import json
+import math
+import random  # To jitter reconnect delays
+import time
+
+
+class InboxPolicy(Enum):
+    Fifo = 0  # Every message is handled in order
+    Latest = 1  # Only the newest waiting message of a topic is handled (for state topics)
+
+
+class ConnectionState(Enum):
+    Disconnected = 0  # Not started or stopped
+    Connecting = 1  # Waiting for the server to accept the connection
+    Connected = 2
+    Waiting = 3  # Waiting to retry after a failed or lost connection
+
+
+class TopicTrie:
+    class _Node:
+        __slots__ = ('children', 'handlers', 'stats', 'policy')
+
+        def __init__(self):
+            self.children = {}  # { 'level': node }
+            self.handlers = []  # Handlers of the filter ending at this node
+            self.stats = None  # Counters of the filter ending at this node
+            self.policy = InboxPolicy.Fifo  # Queueing of the filter ending at this node
+
+    def __init__(self):
+        """
+        Routes topics to handlers in O(topic depth), supports the MQTT "+" (one level) and "#" (remaining levels)
+        wildcards and several handlers per topic filter
+        """
+        self._root = self._Node()
+        self._filters = {}  # Subscribed filters -> { 'filter': node }
+
+    def __contains__(self, topic_filter: str) -> bool:
+        return topic_filter in self._filters
+
+    def __iter__(self):
+        return iter(list(self._filters))
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    def add(self, topic_filter: str, handler, policy: InboxPolicy = None) -> bool:
+        """
+        :param topic_filter: Topic, can contain wildcards (eg. "homeassistant/+/state")
+        :param handler: Called with (client, userdata, msg)
+        :param policy: Queueing of messages matching the filter (None keeps the current policy)
+        :return: If the handler was added (False if it is already subscribed to the filter)
+        """
+        node = self._root
+        for level in topic_filter.split('/'):
+            node = node.children.setdefault(level, self._Node())
+        if policy is not None:
+            node.policy = policy
+
+        if handler in node.handlers:
+            return False
+        node.handlers.append(handler)
+        if node.stats is None:
+            node.stats = {'messages': 0, 'bytes': 0, 'handler_ms': 0.0, 'max_ms': 0.0}
+        self._filters[topic_filter] = node
+        return True
+
+    def remove(self, topic_filter: str, handler=None) -> bool:
+        """
+        :param topic_filter: Topic filter to remove handlers from
+        :param handler: Handler to remove (None removes all of them)
+        :return: If the filter has no handlers left
+        """
+        path = [self._root]
+        for level in topic_filter.split('/'):
+            node = path[-1].children.get(level)
+            if node is None:
+                return True
+            path.append(node)
+
+        node = path[-1]
+        if handler is None:
+            node.handlers.clear()
+        elif handler in node.handlers:
+            node.handlers.remove(handler)
+        if node.handlers:
+            return False
+
+        node.stats = None
+        node.policy = InboxPolicy.Fifo
+        self._filters.pop(topic_filter, None)
+        levels = topic_filter.split('/')
+        for i in range(len(levels), 0, -1):  # Prune empty branches
+            if path[i].handlers or path[i].children:
+                break
+            del path[i - 1].children[levels[i - 1]]
+        return True
+
+    def match(self, topic: str) -> list:
+        """
+        :param topic: The topic of a received message
+        :return: The nodes of every filter matching the topic
+        """
+        levels = topic.split('/')
+        matches = []
+        self._match(self._root, levels, 0, matches, topic.startswith('$'))
+        return matches
+
+    def _match(self, node, levels: list[str], depth: int, matches: list, system: bool) -> None:
+        wildcards = not (system and depth == 0)  # Wildcards do not match "$SYS" style topics
+
+        if wildcards and '#' in node.children:  # Matches this level and everything below
+            matches.append(node.children['#'])
+
+        if depth == len(levels):
+            if node.handlers:
+                matches.append(node)
+            return
+
+        child = node.children.get(levels[depth])
+        if child is not None:
+            self._match(child, levels, depth + 1, matches, system)
+        if wildcards and '+' in node.children:
+            self._match(node.children['+'], levels, depth + 1, matches, system)
+
+    def get_stats(self) -> dict:
+        """
+        :return: Counters per filter -> { 'filter': { messages, bytes, handlers, handler_ms, max_ms } }
+        """
+        return {topic_filter: dict(node.stats, handlers=len(node.handlers))
+                for topic_filter, node in self._filters.items()}
+
 
 class MqttClient(Log):
-    _RECONNECT_COUNT = 12  # Amount of reconnect attempts
     _RECONNECT_INTERVAL = 1  # Delay between reconnect attempts (s)
-    _RECONNECT_MAX_INTERVAL = 1200  # Max interval amount (s)
+    _RECONNECT_MAX_INTERVAL = 300  # Max interval amount (s)
     _RECONNECT_RATE = 2  # Multiply interval by {n} each attempt
+    _LOOP_TIMEOUT = 0.1  # Longest the network thread blocks waiting for packets (s)
+    _STOP_TIMEOUT = 1  # Longest disconnect() waits for the network thread, it can be stuck connecting (s)
+    _INBOX_SIZE = 256  # Maximum messages waiting to be processed, the oldest are dropped
+    _OUTBOX_SIZE = 64  # Maximum messages published whilst offline, the oldest are dropped
 
     def __init__(self, client_id: str, host: str, username: str, password: str, port=1883):
         """
@@ -24,43 +163,162 @@ class MqttClient(Log):
         self._port = port
         self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, self._client_id)
 
-        self.topics = {}  # Subscribed topics -> { 'topic': response() }
+        self.topics = TopicTrie()  # Subscribed topics -> { 'topic': [response()] }
+
+        self._inbox_lock = threading.Lock()
+        self._inbox = OrderedDict()  # Messages waiting for process() -> { 'topic' or sequence: msg } oldest first
+        self._inbox_seq = 0  # Key of messages that are not coalesced
+        self.dropped = 0  # Messages dropped because the inbox was full
+        self.coalesced = 0  # Messages replaced by a newer message of the same topic
+
+        self.state = ConnectionState.Disconnected
+        self._state_lock = threading.Lock()
+        self._thread = None  # Network thread, runs the connection state machine
+        self._running = False
+        self._attempts = 0  # Failed connection attempts since last connected
+        self._retry_at = 0  # Timestamp of the next connection attempt (s)
+        self._outbox = OrderedDict()  # Published whilst offline -> { 'topic' or sequence: (topic, payload) }
+        self._outbox_seq = 0
+        self._recorder = None  # Writes received messages to a trace file
+        self._replayer = None  # Replays a trace file instead of connecting (simulation)
+
+        self._publish = {}  # Publish options per topic -> { 'topic': {qos, retain, coalesce, interval, last} }
+        self._pending = {}  # Publishes held back by coalescing / rate limits -> { 'topic': (payload, collapse, due) }
+        self.held = 0  # Publishes replaced by a newer publish before being sent
 
     def _on_connect(self, client, userdata, flags, rc, properties):
-        if rc == 0:
-            self.log(f"Connected to \"{self._host}\" with id \"{self._client_id}\"", LogLevel.INF)
-        else:
-            self.log(f"Failed to connect to \"{self._host}\"", LogLevel.ERR, "code: " + rc)
+        if rc != 0:
+            self.log(f"Failed to connect to \"{self._host}\"", LogLevel.ERR, "code: " + str(rc))
+            self._retry()
+            return
+
+        self.log(f"Connected to \"{self._host}\" with id \"{self._client_id}\"", LogLevel.INF)
+        if len(self.topics):  # Subscriptions are lost with the session, subscribe again
+            self._client.subscribe([(t, 0) for t in self.topics])
+            self.log("Resubscribed to " + str(len(self.topics)) + " topics", LogLevel.INF)
+
+        with self._state_lock:  # Held whilst sending, so pub() cannot send ahead of older queued messages
+            self.state = ConnectionState.Connected
+            self._attempts = 0
+            outbox = list(self._outbox.values())
+            self._outbox.clear()
+            for topic, payload in outbox:  # Send in order
+                self._publish_now(topic, payload)
+        if outbox:
+            self.log("Sent " + str(len(outbox)) + " messages published whilst offline", LogLevel.INF)
+        FrameScheduler.wake()
 
     def _on_disconnect(self, client, userdata, flags, rc, properties):
-        self.log(f"Disconnected from \"{self._host}\"", LogLevel.WRN, "code: " + rc)
-        count = 0
-        delay = self._RECONNECT_INTERVAL
-        while count < self._RECONNECT_COUNT:
-            self.log(f"Reconnecting in {delay}s...", LogLevel.INF)
-            time.wait(delay * 1000)
-
-            try:
-                client.reconnect()
-                self.log("Reconnected successfully!", LogLevel.INF)
-                return
-            except Exception as e:
-                self.handle("Reconnect failed. Retrying...", e)
-
-            delay *= self._RECONNECT_RATE
-            delay = min(delay, self._RECONNECT_MAX_INTERVAL)
-            count += 1
-        self.log(f"Reconnect failed, exiting...", LogLevel.ERR, "attempts: " + count)
-        raise KeyboardInterrupt
-
-    def _on_message(self, client, userdata, msg):
-        for t in self.topics:  # Delegate message to functions
-            if t == msg.topic:
-                self.topics[t](client, userdata, msg)
+        if not self._running:  # Disconnected on purpose
+            return
+        self.log(f"Disconnected from \"{self._host}\"", LogLevel.WRN, "code: " + str(rc))
+        self._retry()
+
+    def _retry(self) -> None:
+        """
+        Schedules the next connection attempt with an exponential, jittered backoff
+        """
+        with self._state_lock:
+            if self.state is ConnectionState.Waiting:
                 return
+            delay = min(self._RECONNECT_INTERVAL * self._RECONNECT_RATE ** self._attempts,
+                        self._RECONNECT_MAX_INTERVAL)
+            delay = delay / 2 + random.uniform(0, delay / 2)  # Spread clients out after a server restart
+            self._attempts += 1
+            self._retry_at = time.monotonic() + delay
+            self.state = ConnectionState.Waiting
+        self.log(f"Reconnecting in {delay:.1f}s...", LogLevel.INF, "attempt: " + str(self._attempts))
+        FrameScheduler.wake()
+
+    def _run(self) -> None:
+        while self._running:
+            if self.state is ConnectionState.Waiting:
+                delay = self._retry_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(min(delay, self._LOOP_TIMEOUT))  # Stay responsive to disconnect()
+                    continue
+
+                with self._state_lock:
+                    self.state = ConnectionState.Connecting
+                try:
+                    if self._attempts or self._client.is_connected():
+                        self._client.reconnect()
+                    else:
+                        self._client.connect(self._host, self._port)
+                except Exception as err:
+                    self.log("Connect failed", LogLevel.WRN, data=str(err))
+                    self._retry()
+                continue
+
+            rc = self._client.loop(self._LOOP_TIMEOUT)  # Sends, receives and keeps the connection alive
+            if rc != mqtt.MQTT_ERR_SUCCESS and self._running:
+                if self.state is not ConnectionState.Waiting:
+                    self.log("Connection lost", LogLevel.WRN, "code: " + str(rc))
+                    self._retry()
+                time.sleep(self._LOOP_TIMEOUT)  # Not connected, do not spin
+
+    def _on_message(self, client, userdata, msg):  # Runs on the network thread, must not block
+        if self._recorder is not None:
+            self._recorder.write(msg.topic, msg.payload)
+
+        nodes = self.topics.match(msg.topic)
+        if not nodes:
+            return
+
+        latest = any(node.policy is InboxPolicy.Latest for node in nodes)
+        with self._inbox_lock:
+            if latest:
+                key = msg.topic
+                if key in self._inbox:  # Replace the waiting message (it was never decoded)
+                    self._inbox.move_to_end(key)
+                    self.coalesced += 1
+            else:
+                key = self._inbox_seq
+                self._inbox_seq += 1
+
+            self._inbox[key] = msg
+            if len(self._inbox) > self._INBOX_SIZE:
+                self._inbox.popitem(last=False)
+                self.dropped += 1
+        FrameScheduler.wake()  # Process and draw the result straight away
+
+    def process(self) -> int:
+        """
+        Delegates waiting messages to their subscribers, call once per frame from the main loop
+        :return: The amount of messages processed
+        """
+        with self._inbox_lock:
+            if not self._inbox:
+                return 0
+            messages = list(self._inbox.values())
+            self._inbox.clear()
+
+        for msg in messages:
+            for node in self.topics.match(msg.topic):  # Delegate message to functions
+                timestamp = time.perf_counter()
+                for response in list(node.handlers):  # Handlers may unsubscribe
+                    try:
+                        response(self._client, None, msg)
+                    except Exception as err:
+                        self.handle(err, data="topic: " + msg.topic)
+
+                elapsed = (time.perf_counter() - timestamp) * 1000
+                if node.stats is not None:
+                    node.stats['messages'] += 1
+                    node.stats['bytes'] += len(msg.payload)
+                    node.stats['handler_ms'] += elapsed
+                    node.stats['max_ms'] = max(node.stats['max_ms'], elapsed)
+        return len(messages)
+
+    def get_stats(self) -> dict:
+        return {'topics': self.topics.get_stats(), 'dropped': self.dropped, 'coalesced': self.coalesced,
+                'held': self.held}
 
     def get_connected(self):
-        return self._client.is_connected()
+        return self.state is ConnectionState.Connected
+
+    def get_state(self) -> ConnectionState:
+        return self.state
 
     def get_host(self):
         return self._host
@@ -71,54 +329,210 @@ class MqttClient(Log):
     def get_id(self):
         return self._client_id
 
+    def record(self, path: str) -> None:
+        """
+        Writes every received message to a trace file, which can be replayed with simulate()
+        :param path: The trace file (appended to if it exists)
+        """
+        self._recorder = TraceRecorder(path)
+
+    def simulate(self, path: str, speed=1.0) -> None:
+        """
+        Replays a trace file instead of connecting to the server, call before connect().
+        The replay begins with start_replay(), once everything that handles messages has subscribed.
+        Messages are handled exactly like received messages, publishes are dropped.
+        :param path: The trace file
+        :param speed: Replay speed (2 = twice as fast), 0 replays as fast as possible
+        """
+        self._replayer = TraceReplayer(path, self._replay, speed)
+
+    def _replay(self, topic: str, payload: bytes) -> None:
+        msg = mqtt.MQTTMessage(topic=topic.encode())
+        msg.payload = payload
+        self._on_message(self._client, None, msg)
+
+    def start_replay(self) -> None:
+        """
+        Starts replaying the trace file given to simulate(), messages to topics not subscribed to yet are lost
+        """
+        if self._replayer is not None and not self._replayer.is_running():
+            self._replayer.start()
+
     def connect(self):
+        if self._replayer is not None:  # Simulating, there is no server (the replay starts with start_replay())
+            self.state = ConnectionState.Connected
+            return
+
         self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, self._client_id)
         self._client.username_pw_set(self._username, self._password)
         #self._client.will_set("miniplayer/mqtt/disconnected", payload=self._client_id)
         self._client.on_connect = self._on_connect
         self._client.on_disconnect = self._on_disconnect
         self._client.on_message = self._on_message
-        self._client.connect(self._host, self._port)
-        self._client.loop_start()
+
+        # Connect on the network thread so the UI keeps running whilst the server is unreachable
+        self._attempts = 0
+        self._retry_at = 0
+        self.state = ConnectionState.Waiting
+        self._running = True
+        self._thread = threading.Thread(name='Mqtt', target=self._run, daemon=True)
+        self._thread.start()
+        self.log(f"Connecting to \"{self._host}\"...", LogLevel.INF)
         #self.pub("miniplayer/mqtt/connected", payload=self._client_id)
 
     def disconnect(self):
-        self._client.on_disconnect = None  # Do not attempt to reconnect
-        self._client.disconnect()
+        self.log("Topic stats", LogLevel.INF, data=str(self.get_stats()))
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+        if self._replayer is not None:
+            self._replayer.stop()
+            self.unsub_all()
+            self.state = ConnectionState.Disconnected
+            return
+
+        self._running = False  # Do not attempt to reconnect
         self.unsub_all()
-        self._client.loop_stop()
+        self._client.disconnect()
+        if self._thread is not None:
+            self._thread.join(self._STOP_TIMEOUT)
+            if self._thread.is_alive():  # Blocked connecting (DNS / TCP), it is a daemon so it ends with the program
+                self.log("Network thread did not stop in time", LogLevel.WRN,
+                         data="timeout: " + str(self._STOP_TIMEOUT) + "s")
+            self._thread = None
+        self.state = ConnectionState.Disconnected
 
     def unsub_all(self):
         for t in self.topics:
             self._client.unsubscribe(t)
-        self.topics = {}
+        self.topics = TopicTrie()
         self.log("Unsubscribed from all topics", LogLevel.INF)
 
-    def unsub(self, topic: str or tuple):
+    def unsub(self, topic: str or tuple, response=None):
+        """
+        :param topic: Topic(s) to unsubscribe from
+        :param response: Only remove this handler (None removes all handlers)
+        """
         if type(topic) is str:  # Convert single to tuple
             topic = [topic]
 
         for t in topic:
-            self._client.unsubscribe(t)
             if t in self.topics:
-                self.topics.pop(t)
-                self.log("Unsubscribed from " + t, LogLevel.INF)
+                if self.topics.remove(t, response):  # No handlers left
+                    self._client.unsubscribe(t)
+                    self.log("Unsubscribed from " + t, LogLevel.INF)
             else:
                 self.log(t + " was not subscribed to, cannot unsub", LogLevel.WRN)
 
-    def sub(self, topic: str or tuple, response):
+    def sub(self, topic: str or tuple, response, policy: InboxPolicy = None):
+        """
+        :param topic: Topic(s) to subscribe to, can contain the wildcards "+" and "#"
+        :param response: Called with (client, userdata, msg) from process(), a topic can have several
+        :param policy: InboxPolicy.Latest to only handle the newest message when several are waiting,
+         None keeps the policy of the topic (Fifo for a new topic)
+        """
         if type(topic) is str:  # Convert single to tuple
             topic = [topic]
 
         for t in topic:
-            if t not in self.topics:
-                self._client.subscribe(t)
-                self.topics.update({t: response})  # Insert to dict
+            is_new = t not in self.topics
+            if self.topics.add(t, response, policy):
+                if is_new:
+                    self._client.subscribe(t)
                 self.log("Subscribed to " + t, LogLevel.INF)
             else:
                 self.log(t + " is already subscribed to", LogLevel.WRN)
 
-    def pub(self, topic: str, payload: str or dict):
-        msg = str(payload).replace("'", "\"")  # Convert single quotes to double (because of dict)
-        self._client.publish(topic, payload=msg)
-        self.log(f"Sent \"{msg}\" to {topic}", LogLevel.INF)
+    def set_publish(self, topic: str, qos=0, retain=False, coalesce=0, rate=0.0) -> None:
+        """
+        Sets how messages are published to a topic
+        :param topic: The topic
+        :param qos: MQTT quality of service (0, 1 or 2)
+        :param retain: The server keeps the last message for new subscribers
+        :param coalesce: Wait this long for newer messages, only the newest is sent (ms)
+        :param rate: Maximum messages sent per second (0 = unlimited), newer messages replace waiting ones
+        """
+        self._publish[topic] = {'qos': qos, 'retain': retain, 'coalesce': coalesce / 1000,
+                                'interval': 1 / rate if rate else 0.0, 'last': 0.0}
+
+    def pub(self, topic: str, payload: str or dict, collapse=False):
+        """
+        Publishes a message, messages published whilst offline are sent once reconnected
+        :param topic: The topic to publish to
+        :param payload: The message (anything else than a string is encoded as JSON)
+        :param collapse: Only keep the newest offline message of this topic (for state messages)
+        """
+        msg = payload if isinstance(payload, (str, bytes)) else json.dumps(payload)  # Encode once
+
+        options = self._publish.get(topic)
+        if options is not None and (options['coalesce'] or options['interval']):
+            now = time.monotonic()
+            if topic in self._pending:  # Replace the waiting message
+                self._pending[topic] = msg, collapse, self._pending[topic][2]
+                self.held += 1
+                return
+
+            due = max(now + options['coalesce'], options['last'] + options['interval'])
+            if due > now:
+                self._pending[topic] = msg, collapse, due
+                FrameScheduler.wake()  # Include the new deadline
+                return
+
+        self._send(topic, msg, collapse)
+
+    def flush(self) -> int:
+        """
+        Sends held back messages that are due, call once per frame from the main loop
+        :return: The amount of messages sent
+        """
+        if not self._pending:
+            return 0
+
+        now = time.monotonic()
+        due = [topic for topic, (msg, collapse, timestamp) in self._pending.items() if timestamp <= now]
+        for topic in due:
+            msg, collapse, timestamp = self._pending.pop(topic)
+            self._send(topic, msg, collapse)
+        return len(due)
+
+    def get_deadline(self) -> int or None:
+        """
+        :return: Timestamp (ms) the next held back message is due, or None
+        """
+        if not self._pending:
+            return None
+        delay = min(timestamp for msg, collapse, timestamp in self._pending.values()) - time.monotonic()
+        return pg.time.get_ticks() + max(math.ceil(delay * 1000), 0)
+
+    def _send(self, topic: str, msg: str or bytes, collapse: bool) -> None:
+        options = self._publish.get(topic)
+        if options is not None:
+            options['last'] = time.monotonic()
+
+        with self._state_lock:
+            if self.state is not ConnectionState.Connected:
+                if collapse:
+                    key = topic
+                    self._outbox.pop(key, None)  # Send in the position of the newest message
+                else:
+                    key = self._outbox_seq
+                    self._outbox_seq += 1
+                self._outbox[key] = topic, msg
+                if len(self._outbox) > self._OUTBOX_SIZE:
+                    self._outbox.popitem(last=False)
+                self.log("Offline, queued \"%s\" to %s", LogLevel.DBG, args=(msg, topic))
+                return
+
+        self._publish_now(topic, msg)
+
+    def _publish_now(self, topic: str, msg: str or bytes) -> None:
+        if self._replayer is not None:  # Simulating, there is no server
+            self.log("Simulated, not sent \"%s\" to %s", LogLevel.DBG, args=(msg, topic))
+            return
+
+        options = self._publish.get(topic)
+        if options is not None:
+            self._client.publish(topic, payload=msg, qos=options['qos'], retain=options['retain'])
+        else:
+            self._client.publish(topic, payload=msg)
+        self.log("Sent \"%s\" to %s", LogLevel.DBG, args=(msg, topic))
@@ -1,10 +1,12 @@
 from ui import *
-from mqtt import MqttClient
+from mqtt import MqttClient, InboxPolicy
+from webclient import HttpClient
 import json  # To decode messages from MQTT (used by subclasses)
 
 class PluginBase(Log):
     _Mqtt = MqttClient
     _Ui = Ui
+    _Http = HttpClient
 
     def __init__(self, name: str):
         super().__init__(name)
@@ -18,6 +20,10 @@ class PluginBase(Log):
     def set_ui(ui: Ui):
         PluginBase._Ui = ui
 
+    @staticmethod
+    def set_http(http: HttpClient):
+        PluginBase._Http = http
+
     def _enable(self) -> None:
         """
         To be overwritten by subclasses.
@@ -77,3 +83,11 @@ class PluginBase(Log):
         """
         if self._is_enabled:
             self._update()
+
+    def get_deadline(self) -> int or None:
+        """
+        To be overwritten by subclasses.\n
+        The next time (ms) the plugin needs to update without an event
+        :return: Timestamp from pg.time.get_ticks(), or None if nothing is scheduled
+        """
+        return None
@@ -1,4 +1,5 @@
 from plugin import *  # Plugin base class
+from backlight import GpioPwmBacklight, SoftwareBacklight
 from pygame import surface
 import RPi.GPIO as GPIO
 
@@ -11,8 +12,15 @@ class ScreenBrightnessGpio(PluginBase):
         self.en_pin = 25
         self.on_state = "ON"  # Set to "OFF" to invert GPIO
         self.default_state = GPIO.HIGH
+        self.use_pwm = False  # Dim the backlight with PWM on en_pin (instead of a software overlay)
+        self._brightness = 255
 
     def _enable(self):
+        if self.use_pwm:
+            self._Ui.set_backlight(GpioPwmBacklight(self.en_pin))
+            self._Mqtt.sub((self._mqtt_bl_set, self._mqtt_bl_brightness), self._receive)
+            return
+
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(self.en_pin, GPIO.OUT)
 
@@ -21,21 +29,31 @@ class ScreenBrightnessGpio(PluginBase):
         self._Mqtt.sub((self._mqtt_bl_set, self._mqtt_bl_brightness), self._receive)
 
     def _disable(self):
-        GPIO.cleanup(self.en_pin)
+        if self.use_pwm:
+            self._Ui.set_backlight(SoftwareBacklight())  # Stops PWM and cleans up the pin
+        else:
+            GPIO.cleanup(self.en_pin)
 
         self._Mqtt.unsub((self._mqtt_bl_set, self._mqtt_bl_brightness))
 
     def _receive(self, client, userdata, msg) -> None:
-        self.log("Received a message!", LogLevel.INF)
+        self.log("Received a message!", LogLevel.DBG, every=10)
+
+        if msg.topic == self._mqtt_bl_set and self.use_pwm:  # Turn on / off PWM
+            self._Ui.set_brightness(self._brightness if msg.payload.decode() == self.on_state else 0)
+            self.log("Set PWM to " + msg.payload.decode(), LogLevel.INF)
+            return
 
-        if msg.topic == self._mqtt_bl_set:  # Turn on / off GPIO
+        elif msg.topic == self._mqtt_bl_set:  # Turn on / off GPIO
             GPIO.output(self.en_pin, self.default_state if msg.payload.decode() == self.on_state else (GPIO.LOW if self.default_state == GPIO.HIGH else GPIO.HIGH))
             self.log("Set GPIO to " + msg.payload.decode(), LogLevel.INF)
             return
 
         elif msg.topic == self._mqtt_bl_brightness:  # Set backlight brightness
             msg = json.loads(msg.payload.decode())  # Convert string response to dict (json)
-            GPIO.output(self.en_pin, True)
+            self._brightness = msg
+            if not self.use_pwm:
+                GPIO.output(self.en_pin, True)
             self._Ui.set_brightness(msg)
             self.log("Set brightness to " + str(msg), LogLevel.INF)
             return
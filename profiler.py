@@ -0,0 +1,161 @@
+from log import *
+from ui import Ui
+from collections import deque
+import pygame as pg
+import time
+
+
+class Profiler(Log):
+    _mqtt_set = 'miniplayer/profiler/set'  # Payload "ON", "OFF" or "TOGGLE"
+    _Key = pg.K_F3  # Toggles the overlay
+
+    _Width = 330
+    _Line_height = 18
+    _Spark_height = 40
+    _Spark_max = 1000 / 30  # Frame time at the top of the sparkline (ms)
+
+    def __init__(self, samples=120, refresh=250):
+        """
+        Times each phase of a frame and shows rolling statistics in an overlay
+        :param samples: Frames to keep statistics over
+        :param refresh: Time between overlay updates (ms)
+        """
+        super().__init__('Profiler')
+        self.enabled = False
+        self._samples = samples
+        self._refresh = refresh
+
+        self._phases = {}  # Recent times per phase -> { 'name': deque(ms) } in order of first use
+        self._frames = deque(maxlen=samples)  # Recent frame times (ms)
+        self._mark = 0  # Timestamp of the last mark (s)
+        self._total = 0.0  # Time of the phases so far this frame (ms)
+
+        self._font = None
+        self._surf = None  # Overlay, rebuilt every refresh
+        self._version = 0  # Identifies the overlay contents (for damage tracking)
+        self._timestamp = 0  # Timestamp the overlay was last rebuilt (ms)
+
+    def set_enabled(self, enabled: bool) -> None:
+        if enabled != self.enabled:
+            self.enabled = enabled
+            self._phases.clear()
+            self._frames.clear()
+            self._surf = None
+            self.log("Enabled" if enabled else "Disabled", LogLevel.INF)
+
+    def toggle(self) -> None:
+        self.set_enabled(not self.enabled)
+
+    def receive(self, client, userdata, msg) -> None:
+        payload = msg.payload.decode().strip().upper()
+        if payload == 'TOGGLE':
+            self.toggle()
+        else:
+            self.set_enabled(payload == 'ON')
+
+    def begin(self) -> None:
+        """
+        Starts timing a frame, call after waiting for the next frame
+        """
+        if self.enabled:
+            self._mark = time.perf_counter()
+            self._total = 0.0
+
+    def mark(self, name: str) -> None:
+        """
+        Records the time since the last mark (or begin()) as a phase
+        :param name: Name of the phase that just finished (eg. "window.update")
+        """
+        if self.enabled:
+            now = time.perf_counter()
+            self.add(name, (now - self._mark) * 1000)
+            self._mark = now
+
+    def add(self, name: str, elapsed: float, frame=True) -> None:
+        """
+        Records a phase timed elsewhere (eg. by the FrameScheduler)
+        :param name: Name of the phase
+        :param elapsed: Time of the phase (ms)
+        :param frame: Count the phase in the frame time (False for time spent sleeping)
+        """
+        if self.enabled:
+            phase = self._phases.get(name)
+            if phase is None:
+                phase = self._phases[name] = deque(maxlen=self._samples)
+            phase.append(elapsed)
+            if frame:
+                self._total += elapsed
+
+    def skip(self) -> None:
+        """
+        Excludes the time since the last mark from the next phase (eg. drawing the overlay)
+        """
+        if self.enabled:
+            self._mark = time.perf_counter()
+
+    def end(self) -> None:
+        """
+        Finishes timing a frame, the frame time is the sum of its phases
+        """
+        if self.enabled:
+            self._frames.append(self._total)
+
+    def get_stats(self) -> dict:
+        """
+        :return: Statistics per phase and for the whole frame -> { 'name': (p50, p95, max) } (ms)
+        """
+        stats = {name: self._percentiles(times) for name, times in self._phases.items()}
+        stats['frame'] = self._percentiles(self._frames)
+        return stats
+
+    def draw(self, ui: Ui) -> None:
+        """
+        Draws the overlay in the top left of the display
+        """
+        if not self.enabled or not self._frames:
+            return
+
+        if self._surf is None or pg.time.get_ticks() >= self._timestamp + self._refresh:
+            self._surf = self._build()
+            self._version += 1
+            self._timestamp = pg.time.get_ticks()
+        ui.blit(self._surf, (0, 0), key=('profiler', self._version))
+
+    def _build(self) -> pg.surface.Surface:
+        if self._font is None:
+            self._font = pg.font.Font(None, self._Line_height + 2)
+
+        stats = self.get_stats()
+        height = self._Line_height * (len(stats) + 1) + self._Spark_height + 12
+        surf = pg.surface.Surface((self._Width, height), pg.SRCALPHA)
+        surf.fill((0, 0, 0, 180))
+
+        rows = [('phase (ms)', ('p50', 'p95', 'max'), (150, 150, 150))]
+        for name, values in stats.items():
+            rows.append((name, tuple(f"{value:.1f}" for value in values),
+                         (255, 255, 255) if name != 'frame' else (110, 240, 140)))
+
+        y = 4
+        for name, values, colour in rows:
+            surf.blit(self._font.render(name, True, colour), (6, y))
+            for column, value in enumerate(values):  # Right aligned columns
+                txt = self._font.render(value, True, colour)
+                surf.blit(txt, txt.get_rect(topright=(self._Width - 136 + column * 65, y)))
+            y += self._Line_height
+
+        # Sparkline of recent frame times, red above the frame budget
+        bottom = height - 4
+        step = (self._Width - 12) / self._samples
+        for index, value in enumerate(self._frames):
+            x = 6 + index * step
+            top = bottom - min(value / self._Spark_max, 1) * self._Spark_height
+            colour = (255, 50, 50) if value > self._Spark_max else (3, 140, 252)
+            pg.draw.line(surf, colour, (x, bottom), (x, top), max(int(step), 1))
+        return surf
+
+    @staticmethod
+    def _percentiles(times) -> tuple[float, float, float]:
+        if not times:
+            return 0.0, 0.0, 0.0
+        ordered = sorted(times)
+        return (ordered[len(ordered) // 2], ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], ordered[-1])
@@ -0,0 +1,144 @@
+from log import *
+import threading
+import struct  # To read / write trace records
+import time
+
+
+class TraceRecorder(Log):
+    MAGIC = b'MPTR\x01'  # Identifies trace files (and their version)
+    RECORD = struct.Struct('<dHI')  # Time since recording started (s), topic length, payload length
+
+    def __init__(self, path: str):
+        """
+        Appends messages to a trace file, which can be replayed with TraceReplayer.
+        Each record is the time, topic and payload of a message.
+        :param path: The trace file (created if it does not exist)
+        """
+        super().__init__('Trace recorder')
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+
+        offset = 0.0
+        if os.path.exists(path) and os.path.getsize(path) > 0:  # Append after the last complete record
+            offset, end = self._find_end(path)
+            self._file = open(path, 'r+b')
+            self._file.truncate(end)  # Drop a record cut short by a crash
+            self._file.seek(end)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(self.MAGIC)
+        self._start = time.monotonic() - offset  # Appended messages continue from the last timestamp
+        self.log("Recording", LogLevel.INF, data="path: " + path)
+
+    def write(self, topic: str, payload: bytes) -> None:
+        topic = topic.encode()
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(self.RECORD.pack(time.monotonic() - self._start, len(topic), len(payload)))
+            self._file.write(topic)
+            self._file.write(payload)
+            self.count += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+        self.log("Stopped recording", LogLevel.INF, data="path: " + self.path + ", messages: " + str(self.count))
+
+    @staticmethod
+    def _find_end(path: str) -> tuple[float, int]:
+        """
+        :param path: An existing trace file
+        :return: The timestamp of the last complete record and the position after it
+        """
+        record = TraceRecorder.RECORD
+        timestamp = 0.0
+        with open(path, 'rb') as file:
+            if file.read(len(TraceRecorder.MAGIC)) != TraceRecorder.MAGIC:
+                raise ValueError("Not a trace file: " + path)
+
+            end = file.tell()
+            size = os.path.getsize(path)
+            while True:
+                header = file.read(record.size)
+                if len(header) < record.size:
+                    return timestamp, end
+                last, topic_length, payload_length = record.unpack(header)
+                if file.tell() + topic_length + payload_length > size:
+                    return timestamp, end
+                file.seek(topic_length + payload_length, os.SEEK_CUR)
+                timestamp, end = last, file.tell()
+
+
+class TraceReplayer(Log):
+    def __init__(self, path: str, callback, speed=1.0):
+        """
+        Replays a trace file on a background thread, keeping the time between messages
+        :param path: The trace file
+        :param callback: Called with (topic, payload) for every message
+        :param speed: Replay speed (2 = twice as fast), 0 replays as fast as possible
+        """
+        super().__init__('Trace replayer')
+        self.path = path
+        self.speed = speed
+        self.count = 0
+        self._callback = callback
+        self._running = False
+        self._thread = None
+
+    @staticmethod
+    def read(path: str):
+        """
+        :param path: The trace file
+        :return: Generator of (time, topic, payload) in order
+        """
+        record = TraceRecorder.RECORD
+        with open(path, 'rb') as file:
+            if file.read(len(TraceRecorder.MAGIC)) != TraceRecorder.MAGIC:
+                raise ValueError("Not a trace file: " + path)
+
+            while True:
+                header = file.read(record.size)
+                if len(header) < record.size:  # End of file (or a record cut short by a crash)
+                    return
+                timestamp, topic_length, payload_length = record.unpack(header)
+                topic = file.read(topic_length)
+                payload = file.read(payload_length)
+                if len(payload) < payload_length:
+                    return
+                yield timestamp, topic.decode(), payload
+
+    def start(self) -> None:
+        self._running = True
+        self._thread = threading.Thread(name='Trace replayer', target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self) -> None:
+        self.log("Replaying", LogLevel.INF, data="path: " + self.path + ", speed: " + str(self.speed or 'max'))
+        start = time.monotonic()
+        try:
+            for timestamp, topic, payload in self.read(self.path):
+                if not self._running:
+                    return
+                if self.speed > 0:  # Wait until the message is due
+                    delay = start + timestamp / self.speed - time.monotonic()
+                    while delay > 0 and self._running:
+                        time.sleep(min(delay, 0.1))  # Stay responsive to stop()
+                        delay = start + timestamp / self.speed - time.monotonic()
+                self._callback(topic, payload)
+                self.count += 1
+        except Exception as err:
+            self.handle(err)
+
+        self.log("Replay finished", LogLevel.INF,
+                 data="messages: " + str(self.count) + ", time: " + f"{time.monotonic() - start:.1f}s")
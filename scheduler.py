@@ -0,0 +1,102 @@
+from log import *
+from enum import Enum
+import pygame as pg
+import time
+
+
+class FrameMode(Enum):
+    Idle = 0  # Nothing changed, woke for a deadline
+    Wake = 1  # Woke by an event (input, MQTT message, etc.)
+    Burst = 2  # Interaction or animation, running at the burst frame rate
+
+
+class FrameScheduler(Log):
+    WAKE_EVENT = pg.event.custom_type()  # Posted to wake the main loop early
+    _INPUT_EVENTS = (pg.MOUSEBUTTONDOWN, pg.MOUSEBUTTONUP, pg.FINGERDOWN, pg.FINGERUP, pg.FINGERMOTION, pg.KEYDOWN)
+
+    _Burst_until = 0  # Timestamp to run at the burst frame rate until (shared so windows can request bursts)
+
+    def __init__(self, fps=15, burst_fps=60, burst_time=500, max_idle=1000):
+        """
+        Decides when the next frame is drawn.
+        Sleeps until the next deadline or event instead of drawing at a fixed rate.
+        :param fps: Maximum frame rate when woken by events
+        :param burst_fps: Frame rate during interaction or animation
+        :param burst_time: How long to keep bursting after an input (ms)
+        :param max_idle: Longest time to sleep without drawing a frame (ms)
+        """
+        super().__init__('Scheduler')
+        self._clock = pg.time.Clock()
+        self.fps = fps
+        self.burst_fps = burst_fps
+        self.burst_time = burst_time
+        self.max_idle = max_idle
+        self.mode = FrameMode.Wake
+        self.pump_ms = 0.0  # Time spent reading events during the last wait (ms)
+        self.idle_ms = 0.0  # Time spent sleeping during the last wait (ms)
+
+    @staticmethod
+    def wake() -> None:
+        """
+        Wakes the main loop to draw a frame, safe to call from any thread
+        """
+        try:
+            pg.event.post(pg.event.Event(FrameScheduler.WAKE_EVENT))
+        except pg.error:  # Event system not running (startup/shutdown)
+            pass
+
+    @staticmethod
+    def burst(duration=500) -> None:
+        """
+        Runs at the burst frame rate, used for animations
+        :param duration: How long to burst for (ms)
+        """
+        FrameScheduler._Burst_until = max(FrameScheduler._Burst_until, pg.time.get_ticks() + duration)
+        FrameScheduler.wake()
+
+    def wait(self, deadlines: list[int or None]) -> list[pg.event.Event]:
+        """
+        Blocks until the next frame should be drawn
+        :param deadlines: Timestamps (ms) that something on screen will change at, None is ignored
+        :return: The events received whilst waiting
+        """
+        start = time.perf_counter()
+        self.pump_ms = 0.0
+        if pg.mouse.get_pressed()[0] or pg.time.get_ticks() < FrameScheduler._Burst_until:
+            self.mode = FrameMode.Burst
+            self._clock.tick(self.burst_fps)
+            events = self._get_events()
+
+        else:
+            self._clock.tick(self.fps)  # Limit the frame rate when flooded with events
+            events = self._get_events()
+
+            if events:
+                self.mode = FrameMode.Wake
+            else:  # Sleep until an event arrives or the next deadline passes
+                timeout = self.max_idle
+                now = pg.time.get_ticks()
+                for deadline in deadlines:
+                    if deadline is not None:
+                        timeout = min(timeout, max(deadline - now, 0))
+
+                event = pg.event.wait(timeout) if timeout > 0 else pg.event.Event(pg.NOEVENT)
+                if event.type != pg.NOEVENT:
+                    events = [event] + self._get_events()
+                    self.mode = FrameMode.Wake
+                else:
+                    self.mode = FrameMode.Idle
+
+        for event in events:  # Burst whilst the user is interacting
+            if event.type in self._INPUT_EVENTS or event.type == pg.MOUSEMOTION and event.buttons[0]:
+                FrameScheduler._Burst_until = pg.time.get_ticks() + self.burst_time
+                break
+
+        self.idle_ms = (time.perf_counter() - start) * 1000 - self.pump_ms
+        return events
+
+    def _get_events(self) -> list[pg.event.Event]:
+        timestamp = time.perf_counter()
+        events = pg.event.get()
+        self.pump_ms += (time.perf_counter() - timestamp) * 1000
+        return events
@@ -0,0 +1,102 @@
+from log import *
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import threading
+import time
+
+
+class Stage:
+    __slots__ = 'name', 'target', 'after', 'start', 'end', 'thread'
+
+    def __init__(self, name: str, target, after: tuple):
+        self.name = name
+        self.target = target
+        self.after = after  # Names of the stages that must finish first
+        self.start = None  # Time since startup began (s)
+        self.end = None
+        self.thread = None  # Name of the thread the stage ran on
+
+
+class Startup(Log):
+    _Poll = 0.05  # Time between progress updates whilst waiting for stages (s)
+
+    def __init__(self, workers=4):
+        """
+        Runs startup stages concurrently, each stage starts as soon as the stages it depends on have finished
+        :param workers: Maximum stages running at once
+        """
+        super().__init__('Startup')
+        self._workers = workers
+        self._stages = {}  # { 'name': Stage } in order added
+        self._start = None
+
+    def add(self, name: str, target, after: str or tuple = ()) -> None:
+        """
+        :param name: Stage name, shown on the splash screen and in the timing report
+        :param target: Called with no arguments on a worker thread
+        :param after: Stage name(s) that must finish before this one starts
+        """
+        after = (after,) if type(after) is str else tuple(after)
+        for dependency in after:
+            if dependency not in self._stages:  # Also rules out cycles
+                raise ValueError(f"Stage \"{name}\" depends on unknown stage \"{dependency}\"")
+        self._stages[name] = Stage(name, target, after)
+
+    def run(self, progress=None) -> None:
+        """
+        Runs every stage, returning once they have all finished.
+        The first error raised by a stage is raised here, stages not started yet are dropped.
+        :param progress: Called on this thread with (finished, total, running names) whenever progress is made
+        """
+        self._start = time.perf_counter()
+        pending = dict(self._stages)
+        running = {}  # { Future: Stage }
+        finished = set()
+
+        executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='Startup')
+        try:
+            while pending or running:
+                for stage in list(pending.values()):  # Start every stage that is ready
+                    if all(dependency in finished for dependency in stage.after):
+                        del pending[stage.name]
+                        running[executor.submit(self._run_stage, stage)] = stage
+
+                if progress is not None:
+                    progress(len(finished), len(self._stages), [stage.name for stage in running.values()])
+
+                done, _ = wait(running, timeout=self._Poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    future.result()  # Raises the error of the stage
+                    finished.add(stage.name)
+        finally:
+            executor.shutdown(wait=not running, cancel_futures=True)  # Do not wait for stages after an error
+
+        if progress is not None:
+            progress(len(finished), len(self._stages), [])
+        self.log("Finished", LogLevel.INF, data=self.get_report)
+
+    def get_report(self) -> str:
+        """
+        :return: Start time and duration of each stage, and the total time
+        """
+        lines = []
+        for stage in self._stages.values():
+            if stage.end is None:
+                lines.append(f"{stage.name}: not finished")
+            else:
+                lines.append(f"{stage.name}: {stage.start * 1000:.0f}ms +{(stage.end - stage.start) * 1000:.0f}ms "
+                             f"({stage.thread})")
+        ends = [stage.end for stage in self._stages.values() if stage.end is not None]
+        lines.append(f"total: {max(ends, default=0) * 1000:.0f}ms")
+        return ', '.join(lines)
+
+    def _run_stage(self, stage: Stage) -> None:
+        stage.thread = threading.current_thread().name
+        stage.start = time.perf_counter() - self._start
+        try:
+            stage.target()
+        except Exception as err:
+            self.handle(err, data="stage: " + stage.name)
+            raise
+        finally:
+            stage.end = time.perf_counter() - self._start
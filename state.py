@@ -0,0 +1,109 @@
+from log import *
+
+
+class StateDiff(Log):
+    _MISSING = object()
+
+    def __init__(self, name: str):
+        """
+        Keeps the last snapshot of a state (eg. a decoded MQTT message) and compares new snapshots field by field,
+        so subscribers only run when the fields they use change.
+        Fields are dotted paths into nested dicts (eg. "item.album.name"), lists are compared as a whole.
+        :param name: Instance name
+        """
+        super().__init__(name)
+        self.state = {}  # Last snapshot
+        self.is_complete = False  # A complete state has been received (merge() alone can leave fields missing)
+        self._subscribers = []  # [(fields, callback)] in order of subscription
+
+    def subscribe(self, fields: str or tuple, callback) -> None:
+        """
+        :param fields: Field(s) to watch (eg. "item.name"), a field also watches everything below it
+        :param callback: Called with the new state when any of the fields change
+        """
+        if type(fields) is str:  # Convert single to tuple
+            fields = (fields,)
+        self._subscribers.append((fields, callback))
+
+    def update(self, state: dict) -> set[str]:
+        """
+        Replaces the snapshot with a complete state and runs the subscribers of changed fields
+        :param state: The new state
+        :return: The fields that changed
+        """
+        changed = set()
+        self._compare(self.state, state, '', changed, removed=True)
+        self.state = state
+        self.is_complete = True
+        self._notify(changed)
+        return changed
+
+    def merge(self, delta: dict) -> set[str]:
+        """
+        Applies a partial state (only the fields that changed) and runs the subscribers of changed fields
+        :param delta: The fields that changed, nested like the state
+        :return: The fields that changed
+        """
+        changed = set()
+        self._compare(self.state, delta, '', changed, removed=False)
+        self._apply(self.state, delta)
+        self._notify(changed)
+        return changed
+
+    def reset(self) -> None:
+        """
+        Forgets the snapshot, so every field counts as changed next update
+        """
+        self.state = {}
+        self.is_complete = False
+
+    def get(self, field: str, default=None):
+        """
+        :param field: Dotted path of the field (eg. "item.album.name")
+        :param default: Returned if the field does not exist
+        """
+        value = self.state
+        for key in field.split('.'):
+            if type(value) is not dict or key not in value:
+                return default
+            value = value[key]
+        return value
+
+    @staticmethod
+    def is_changed(changed: set[str], field: str) -> bool:
+        """
+        :param changed: Fields returned by update() or merge()
+        :param field: Field to check, includes everything below it
+        """
+        prefix = field + '.'
+        for path in changed:
+            if path == field or path.startswith(prefix) or field.startswith(path + '.'):
+                return True
+        return False
+
+    def _notify(self, changed: set[str]) -> None:
+        if not changed:
+            return
+        for fields, callback in self._subscribers:
+            if any(self.is_changed(changed, field) for field in fields):
+                callback(self.state)
+
+    def _compare(self, old, new: dict, path: str, changed: set, removed: bool) -> None:
+        for key, value in new.items():
+            field = path + key
+            old_value = old.get(key, self._MISSING) if type(old) is dict else self._MISSING
+            if type(value) is dict and type(old_value) is dict:
+                self._compare(old_value, value, field + '.', changed, removed)
+            elif old_value is self._MISSING or old_value != value:
+                changed.add(field)
+
+        if removed and type(old) is dict:
+            for key in old.keys() - new.keys():
+                changed.add(path + key)
+
+    def _apply(self, state: dict, delta: dict) -> None:
+        for key, value in delta.items():
+            if type(value) is dict and type(state.get(key)) is dict:
+                self._apply(state[key], value)
+            else:
+                state[key] = value
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from backlight import SysfsBacklight
+
+
+class SysfsBacklightTest(unittest.TestCase):
+    def setUp(self):
+        self._root = tempfile.TemporaryDirectory()
+        self.device = os.path.join(self._root.name, 'rpi_backlight')
+        os.mkdir(self.device)
+        self._write('max_brightness', '200')
+        self._write('brightness', '200')
+
+    def tearDown(self):
+        self._root.cleanup()
+
+    def _write(self, name: str, value: str) -> None:
+        with open(os.path.join(self.device, name), 'w') as file:
+            file.write(value)
+
+    def _read(self, name: str) -> str:
+        with open(os.path.join(self.device, name), 'r') as file:
+            return file.read()
+
+    def test_find(self):
+        self.assertEqual(SysfsBacklight.find(self._root.name), self.device)
+
+    def test_find_none(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.assertIsNone(SysfsBacklight.find(root))
+
+    def test_set_scales_to_max_brightness(self):
+        backlight = SysfsBacklight(SysfsBacklight.find(self._root.name))
+        backlight.set(255)
+        self.assertEqual(self._read('brightness'), '200')
+        backlight.set(128)
+        self.assertEqual(self._read('brightness'), '100')
+        backlight.set(-5)  # Clamped
+        self.assertEqual(self._read('brightness'), '0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import json
+import os
+import tempfile
+import unittest
+
+from windows.spotify import PlaylistStore
+
+
+class PlaylistStoreTest(unittest.TestCase):
+    _Library = json.dumps({'items': [{'name': 'One', 'uri': 'spotify:playlist:1'},
+                                     {'name': 'Two', 'uri': 'spotify:playlist:2'}]}).encode()
+
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._folder.name, 'playlists.json')
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def test_update_and_reload(self):
+        store = PlaylistStore(self.path)
+        self.assertTrue(store.update(self._Library, {'ETag': '"v1"'}))
+        self.assertEqual(store.index('spotify:playlist:2'), 1)
+        self.assertEqual(store.get_headers(), {'If-None-Match': '"v1"'})
+
+        store = PlaylistStore(self.path)  # Loaded from disk
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get_headers(), {'If-None-Match': '"v1"'})
+        self.assertFalse(store.update(self._Library, {'ETag': '"v1"'}))  # Same content
+
+    def test_failed_decode_keeps_version(self):
+        store = PlaylistStore(self.path)
+        store.update(self._Library, {'ETag': '"v1"'})
+        with self.assertRaises(ValueError):
+            store.update(b'{"items": [', {'ETag': '"v2"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+        self.assertEqual(store.get_headers(), {'If-None-Match': '"v1"'})  # v2 was never applied
+
+    def test_no_conditional_headers_when_empty(self):
+        store = PlaylistStore(self.path)
+        store.update(json.dumps({'items': []}).encode(), {'ETag': '"empty"'})
+        self.assertEqual(store.get_headers(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import time
+import unittest
+
+from recorder import TraceRecorder, TraceReplayer
+
+
+class TraceRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._folder.name, 'trace.bin')
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def _read(self) -> list:
+        return [(timestamp, topic, payload) for timestamp, topic, payload in TraceReplayer.read(self.path)]
+
+    def test_read_back(self):
+        recorder = TraceRecorder(self.path)
+        recorder.write('a/b', b'1')
+        recorder.write('a/c', b'{"x": 2}')
+        recorder.close()
+        self.assertEqual([(topic, payload) for _, topic, payload in self._read()],
+                         [('a/b', b'1'), ('a/c', b'{"x": 2}')])
+
+    def test_append_continues_timestamps(self):
+        recorder = TraceRecorder(self.path)
+        recorder.write('t', b'1')
+        time.sleep(0.05)
+        recorder.write('t', b'2')
+        recorder.close()
+
+        recorder = TraceRecorder(self.path)
+        recorder.write('t', b'3')
+        recorder.close()
+
+        timestamps = [timestamp for timestamp, _, _ in self._read()]
+        self.assertEqual(len(timestamps), 3)
+        self.assertEqual(timestamps, sorted(timestamps))  # Never goes back in time
+        self.assertGreaterEqual(timestamps[2], timestamps[1])
+
+    def test_append_drops_torn_record(self):
+        recorder = TraceRecorder(self.path)
+        recorder.write('t', b'1')
+        recorder.close()
+        with open(self.path, 'ab') as file:  # A record cut short by a crash
+            file.write(TraceRecorder.RECORD.pack(1.0, 1, 10) + b't12')
+
+        recorder = TraceRecorder(self.path)
+        recorder.write('t', b'2')
+        recorder.close()
+        self.assertEqual([payload for _, _, payload in self._read()], [b'1', b'2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from state import StateDiff
+
+
+class StateDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.state = StateDiff('Test state')
+        self.calls = []
+        self.state.subscribe('item.name', lambda state: self.calls.append(self.state.get('item.name')))
+
+    def test_update_reports_changed_fields(self):
+        self.state.update({'item': {'id': 'a', 'name': 'A'}, 'progress_ms': 0})
+        changed = self.state.update({'item': {'id': 'a', 'name': 'A'}, 'progress_ms': 1000})
+        self.assertEqual(changed, {'progress_ms'})
+        self.assertEqual(self.calls, ['A'])  # Only the first update changed the name
+
+    def test_merge_on_complete_state(self):
+        self.state.update({'item': {'id': 'a', 'name': 'A'}, 'is_playing': True})
+        changed = self.state.merge({'item': {'name': 'B'}})
+        self.assertEqual(changed, {'item.name'})
+        self.assertEqual(self.state.state, {'item': {'id': 'a', 'name': 'B'}, 'is_playing': True})
+        self.assertEqual(self.calls, ['A', 'B'])
+
+    def test_is_complete(self):
+        self.assertFalse(self.state.is_complete)
+        self.state.merge({'is_playing': False})
+        self.assertFalse(self.state.is_complete)  # A partial state alone is not complete
+        self.state.update({'item': {'id': 'a', 'name': 'A'}})
+        self.assertTrue(self.state.is_complete)
+        self.state.reset()
+        self.assertFalse(self.state.is_complete)
+
+    def test_parent_path_reported(self):
+        self.state.update({'item': None})
+        changed = self.state.update({'item': {'id': 'a', 'name': 'A'}})
+        self.assertEqual(changed, {'item'})  # The old value was not a dict, only the parent is reported
+        self.assertTrue(StateDiff.is_changed(changed, 'item.id'))
+        self.assertFalse(StateDiff.is_changed(changed, 'progress_ms'))
+        self.assertEqual(self.calls, [None, 'A'])
+
+    def test_removed_fields(self):
+        self.state.update({'item': {'id': 'a', 'name': 'A'}, 'context': {'uri': 'x'}})
+        changed = self.state.update({'item': {'id': 'a', 'name': 'A'}})
+        self.assertEqual(changed, {'context'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
 ﻿from log import *
+from cache import LruCache
+from backlight import Backlight, SoftwareBacklight, SysfsBacklight
+from scheduler import FrameScheduler
+from collections import OrderedDict
 from enum import Enum
 import pygame as pg
+import math
 
 
 Colour = {
@@ -11,6 +16,8 @@ Colour = {
     'Black': pg.Color(0, 0, 0),
     'Amber': pg.Color(200, 140, 0),
     'LBlue': pg.Color(3, 140, 252),
+    'Green': pg.Color(30, 200, 80),
+    'LGreen': pg.Color(110, 240, 140),
 }
 
 
@@ -19,10 +26,226 @@ class InputMethod(Enum):
     Touch = 1
 
 
+class TextureAtlas:
+    def __init__(self, cell_size: tuple[int, int], page_size=(1024, 1024), max_pages=2):
+        """
+        Packs many small images of the same size into a few large surfaces, so they are drawn from one texture.
+        Pages are created as needed, the least recently used image is replaced once all pages are full.
+        :param cell_size: Size of each image
+        :param page_size: Size of each page surface
+        :param max_pages: Maximum pages (memory budget)
+        """
+        self.cell_size = tuple(cell_size)
+        self.page_size = tuple(page_size)
+        self.max_pages = max_pages
+
+        self._pages = []
+        self._cells = OrderedDict()  # { key: (page, rect) } least recently used first
+        self._free = []  # Empty cells -> [(page, rect)]
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self._cells
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def add(self, key, surf: pg.surface.Surface) -> None:
+        """
+        :param key: Identifies the image
+        :param surf: The image (scaled to the cell size if needed)
+        """
+        if surf.get_size() != self.cell_size:
+            surf = pg.transform.smoothscale(surf, self.cell_size)
+
+        if key in self._cells:
+            self._cells.move_to_end(key)
+            page, rect = self._cells[key]
+        else:
+            if not self._free and len(self._pages) < self.max_pages:  # Add a page
+                page = pg.surface.Surface(self.page_size, pg.SRCALPHA)
+                self._pages.append(page)
+                for y in range(self.page_size[1] // self.cell_size[1]):
+                    for x in range(self.page_size[0] // self.cell_size[0]):
+                        self._free.append((page, pg.rect.Rect((x * self.cell_size[0], y * self.cell_size[1]),
+                                                              self.cell_size)))
+                self._free.reverse()  # Fill from the top left
+
+            if self._free:
+                page, rect = self._free.pop()
+            else:  # Replace the least recently used image
+                page, rect = self._cells.popitem(last=False)[1]
+                self.evictions += 1
+            self._cells[key] = page, rect
+
+        page.fill((0, 0, 0, 0), rect)
+        page.blit(surf, rect)
+
+    def get(self, key) -> tuple[pg.surface.Surface, pg.rect.Rect] or None:
+        """
+        :param key: Identifies the image
+        :return: The page surface and the area of the image on it, or None if not added
+        """
+        try:
+            self._cells.move_to_end(key)
+        except KeyError:
+            return None
+        return self._cells[key]
+
+    def remove(self, key) -> None:
+        cell = self._cells.pop(key, None)
+        if cell is not None:
+            self._free.append(cell)
+
+
+class ScrollList:
+    _STEP = 1 / 120  # Fixed physics timestep (s)
+    _MAX_STEPS = 12  # Steps simulated per update at most (after a long frame)
+    _FRICTION = 3.5  # Velocity lost per second (exponential)
+    _MIN_VELOCITY = 10  # Stop below this speed (px/s)
+    _DRAG_THRESHOLD = 8  # Movement before a press becomes a drag (px)
+
+    def __init__(self, rect: pg.rect.Rect, row_height: int):
+        """
+        Virtualized list with kinetic scrolling.
+        Only rows that intersect the viewport are laid out, their surfaces are recycled from a small pool,
+        so the cost does not grow with the number of rows.
+        :param rect: The viewport on screen
+        :param row_height: Height of each row
+        """
+        self.rect = pg.rect.Rect(rect)
+        self.row_height = row_height
+        self.count = 0  # Number of rows
+        self.offset = 0.0  # Scroll position (px)
+        self.velocity = 0.0  # Scroll speed (px/s)
+
+        self._timestamp = None  # Time of the last update (ms)
+        self._accumulator = 0.0  # Time not yet simulated (s)
+        self._drag = None  # Drag start -> (mouse y, offset) or None
+        self._drag_samples = []  # Recent drag positions -> [(time, y)]
+        self.is_dragging = False
+
+        self._rows = {}  # Surfaces of visible rows -> { index: (surface, key) }
+        self._pool = []  # Surfaces ready to be reused
+
+    def set_count(self, count: int) -> None:
+        self.count = count
+        self.offset = min(self.offset, self.get_max_offset())
+
+    def get_max_offset(self) -> float:
+        return max(self.count * self.row_height - self.rect.height, 0)
+
+    def get_visible(self) -> range:
+        """
+        :return: Indexes of the rows that intersect the viewport
+        """
+        first = int(self.offset // self.row_height)
+        last = int((self.offset + self.rect.height) // self.row_height) + 1
+        return range(max(first, 0), min(last, self.count))
+
+    def get_row_rect(self, index: int) -> pg.rect.Rect:
+        return pg.rect.Rect(self.rect.left, self.rect.top + index * self.row_height - int(self.offset),
+                            self.rect.width, self.row_height)
+
+    def is_moving(self) -> bool:
+        return self.is_dragging or self.velocity != 0
+
+    def fling(self, velocity: float) -> None:
+        """
+        :param velocity: Speed to scroll at (px/s), positive scrolls down the list
+        """
+        self.velocity = velocity
+
+    def update(self, mouse_pos: tuple[int, int], pressed: bool) -> None:
+        """
+        Handles dragging and simulates scrolling on a fixed timestep
+        :param mouse_pos: Position of the mouse / touch
+        :param pressed: If the mouse / touch is held down
+        """
+        now = pg.time.get_ticks()
+        if self._timestamp is None:
+            self._timestamp = now
+        self._accumulator = min(self._accumulator + (now - self._timestamp) / 1000, self._STEP * self._MAX_STEPS)
+        self._timestamp = now
+
+        if pressed and self._drag is None and self.rect.collidepoint(mouse_pos):  # Start press
+            self._drag = mouse_pos[1], self.offset
+            self._drag_samples = [(now, mouse_pos[1])]
+            self.velocity = 0.0
+        elif pressed and self._drag is not None:  # Dragging
+            if abs(mouse_pos[1] - self._drag[0]) > self._DRAG_THRESHOLD:
+                self.is_dragging = True
+            if self.is_dragging:
+                self.offset = self._clamp(self._drag[1] - (mouse_pos[1] - self._drag[0]))
+            self._drag_samples = [sample for sample in self._drag_samples if now - sample[0] < 100]  # Last 100ms
+            self._drag_samples.append((now, mouse_pos[1]))
+        elif not pressed and self._drag is not None:  # Release, keep the speed of the drag
+            if self.is_dragging and len(self._drag_samples) > 1 and now > self._drag_samples[0][0]:
+                self.velocity = -(mouse_pos[1] - self._drag_samples[0][1]) / ((now - self._drag_samples[0][0]) / 1000)
+            self._drag = None
+            self.is_dragging = False
+
+        while self._accumulator >= self._STEP:  # Fixed timestep
+            self._accumulator -= self._STEP
+            if self.velocity == 0 or self.is_dragging:
+                continue
+            self.offset += self.velocity * self._STEP
+            self.velocity *= math.exp(-self._FRICTION * self._STEP)
+            clamped = self._clamp(self.offset)
+            if clamped != self.offset or abs(self.velocity) < self._MIN_VELOCITY:  # Hit the end / stopped
+                self.offset = clamped
+                self.velocity = 0.0
+
+    def get_row(self, index: int, key, build) -> pg.surface.Surface:
+        """
+        Gets the surface of a visible row, only building it when it scrolls in or its key changes
+        :param index: Index of the row
+        :param key: Identifies the contents of the row
+        :param build: Called with a cleared surface and the index to draw the row
+        :return: The row surface
+        """
+        row = self._rows.get(index)
+        if row is not None and row[1] == key:
+            return row[0]
+
+        if row is not None:
+            surf = row[0]
+        else:
+            visible = self.get_visible()
+            for old_index in [old_index for old_index in self._rows if old_index not in visible]:
+                self._pool.append(self._rows.pop(old_index)[0])  # Recycle rows that scrolled out
+            surf = self._pool.pop() if self._pool else pg.surface.Surface((self.rect.width, self.row_height),
+                                                                         pg.SRCALPHA)
+        surf.fill((0, 0, 0, 0))
+        build(surf, index)
+        self._rows[index] = surf, key
+        return surf
+
+    def clear(self) -> None:
+        """
+        Releases row surfaces, eg. when the list is hidden
+        """
+        self._rows.clear()
+        self._pool.clear()
+        self._drag = None
+        self.is_dragging = False
+        self.velocity = 0.0
+        self._timestamp = None
+
+    def _clamp(self, offset: float) -> float:
+        return min(max(offset, 0), self.get_max_offset())
+
+
 class Ui:
     _Assets = ".\\assets\\ui\\"
-    _Fonts = {}
+    _Fonts = LruCache(16)  # Loaded fonts -> { 'size+path': font }
     _Images = {}
+    _Text = LruCache(4 * 1024 * 1024, sizeof=lambda surf: Ui.sizeof(surf))  # Rendered text (bytes)
+    _Widgets = LruCache(2 * 1024 * 1024, sizeof=lambda widget: Ui.sizeof(widget))  # Drawn bars & buttons (bytes)
+
+    _Damage_tracking = True  # Only upload the regions of the display that changed (dirty rectangles)
+    _Damage_full_ratio = 0.5  # Upload the whole display if more than this fraction of it is damaged
+    _Backlight_detect = False  # Use the kernel backlight driver if one is found (instead of a software overlay)
 
     def __init__(self, size: tuple[int, int], flags=0, display=0):
         self.Display = pg.display.set_mode(size, flags=flags, display=display)
@@ -47,30 +270,174 @@ class Ui:
 
         self._info = '', 'Grey', 0  # Txt, Col, Time
         self._curr_brightness = 255
-        self._brightnessSurf = pg.surface.Surface((self.Width, self.Height)).convert_alpha()
+        self._brightnessSurf = None  # Software dimming overlay, created when first needed
+        self._backlight = self._detect_backlight()
+
+        # Damage tracking variables
+        self._damage = set()  # Draws made this frame -> {(rect, key)}
+        self._prev_damage = set()  # Draws made last frame
+        self._dirty = []  # Regions marked as dirty by windows
+        self._full_update = True  # Upload the whole display next frame
+        self._layers = {}  # Flattened layers -> { name: (surface, key) }
+
+        self.set_brightness(self._curr_brightness)
 
+    def set_backlight(self, backlight: Backlight) -> None:
+        """
+        Replaces the brightness backend (eg. with a GpioPwmBacklight)
+        :param backlight: The new backend
+        """
+        self._backlight.close()
+        self._backlight = backlight
         self.set_brightness(self._curr_brightness)
 
+    def is_hardware_backlight(self) -> bool:
+        return self._backlight.is_hardware
+
     def set_brightness(self, brightness: int) -> None:
         self._curr_brightness = brightness
-        self._brightnessSurf.set_alpha(255 - self._curr_brightness)
+        if self._backlight.is_hardware:
+            try:
+                self._backlight.set(brightness)
+                return
+            except Exception as err:
+                self._backlight.handle(err, trace=False)
+                self._backlight.log("Failed, using software dimming", LogLevel.WRN)
+                self._backlight.close()
+                self._backlight = SoftwareBacklight()
+
+        if brightness < 255:
+            if self._brightnessSurf is None:
+                self._brightnessSurf = pg.surface.Surface((self.Width, self.Height)).convert_alpha()
+                self._brightnessSurf.fill(Colour['Black'])
+            self._brightnessSurf.set_alpha(255 - brightness)
 
     def get_brightness(self) -> int:
         return self._curr_brightness
 
     def apply_brightness(self) -> None:
-        self.Display.blit(self._brightnessSurf, (0, 0))
+        if self._backlight.is_hardware or self._curr_brightness >= 255:  # Nothing to draw
+            return
+        self.blit(self._brightnessSurf, (0, 0), key=('brightness', self._curr_brightness))
+
+    def close(self) -> None:
+        self._backlight.close()
+
+    def _detect_backlight(self) -> Backlight:
+        if self._Backlight_detect:
+            device = SysfsBacklight.find()
+            if device is not None:
+                try:
+                    return SysfsBacklight(device)
+                except Exception as err:
+                    Log("UI").handle(err, trace=False)
+        return SoftwareBacklight()
 
     def clear(self) -> None:
-        self.Display.fill(Colour['Black'])
+        self._track(self.Display.fill(Colour['Black']), 'clear')
 
     def background(self, txt=False) -> None:
-        self.Display.blit(Ui._Images['background'], (0, 0))
+        self.blit(Ui._Images['background'], (0, 0))
         if txt:
             txt = self.text('Miniplayer', 64, center=self.Center)
             self.text('v3.0', 32, bold=False, midtop=(txt[1].centerx, txt[1].bottom + 20))
             self.text('Anthony Guy', 20, bold=False, midbottom=(txt[1].centerx, self.Height - 80))
 
+    def blit(self, surf: pg.surface.Surface, dest: pg.rect.Rect or tuple, key=None, area=None) -> pg.rect.Rect:
+        """
+        Draws a surface to the display and records the area it touched
+        :param surf: Surface to draw
+        :param dest: Position or rect to draw at
+        :param key: Hashable identity of the surface contents (defaults to the surface and its alpha)
+        :param area: Part of the surface to draw (eg. a TextureAtlas cell)
+        :return: The area of the display that was drawn to
+        """
+        rect = self.Display.blit(surf, dest, area)
+        self._track(rect, (id(surf), surf.get_alpha(), None if area is None else tuple(area)) if key is None else key)
+        return rect
+
+    def layer(self, name: str, key, build, area: pg.rect.Rect = None) -> pg.rect.Rect:
+        """
+        Draws a full screen layer that is only redrawn when its key changes.
+        Everything build() draws is flattened into one opaque surface, so drawing the layer is a single blit.
+        :param name: Name of the layer
+        :param key: Hashable state the layer depends on (eg. track and button states)
+        :param build: Called to draw the layer with the Ui methods (draws to the layer instead of the display)
+        :param area: Only build and draw this part of the display (eg. a strip that changes more often)
+        :return: The area of the display that was drawn to
+        """
+        layer = self._layers.get(name)
+        if layer is None or layer[1] != key:
+            surf = layer[0] if layer is not None else pg.surface.Surface((self.Width, self.Height)).convert()
+            display, damage = self.Display, self._damage
+            self.Display, self._damage = surf, set()  # Draws to the layer are not damage to the display
+            try:
+                surf.set_clip(area)  # Draws outside the area are skipped
+                surf.fill(Colour['Black'])
+                build()
+            finally:
+                surf.set_clip(None)
+                self.Display, self._damage = display, damage
+            self._layers[name] = surf, key
+
+        if area is not None:
+            return self.blit(self._layers[name][0], area, key=('layer', name, key), area=area)
+        return self.blit(self._layers[name][0], (0, 0), key=('layer', name, key))
+
+    def remove_layer(self, name: str) -> None:
+        """
+        Frees a layer, eg. when the window using it stops
+        :param name: Name of the layer
+        """
+        self._layers.pop(name, None)
+
+    def mark_dirty(self, rect: pg.rect.Rect or tuple = None) -> None:
+        """
+        Forces a region of the display to be uploaded next frame
+        :param rect: The region to upload (None = whole display)
+        """
+        if rect is None:
+            self._full_update = True
+        else:
+            self._dirty.append(pg.rect.Rect(rect))
+
+    def get_damage(self) -> list[pg.rect.Rect] or None:
+        """
+        Ends the frame and returns the regions of the display that changed since the last one.
+        A draw is damage if it was not made identically (same rect and key) last frame.
+        :return: List of rects to upload, or None to upload the whole display
+        """
+        damage = self._damage ^ self._prev_damage  # Draws that appeared, moved, changed or disappeared
+        self._prev_damage = self._damage
+        self._damage = set()
+
+        dirty = self._dirty
+        self._dirty = []
+
+        if not self._Damage_tracking or self._full_update:
+            self._full_update = False
+            return None
+
+        rects = self._merge_rects([pg.rect.Rect(rect) for rect, key in damage] + dirty)
+        if sum(rect.w * rect.h for rect in rects) > self.Width * self.Height * self._Damage_full_ratio:
+            return None  # Cheaper to upload everything at once
+        return rects
+
+    def _track(self, rect: pg.rect.Rect, key) -> None:
+        if rect.w and rect.h:  # Ignore draws that were clipped away
+            self._damage.add((tuple(rect), key))
+
+    @staticmethod
+    def _merge_rects(rects: list[pg.rect.Rect]) -> list[pg.rect.Rect]:
+        merged = []
+        for rect in rects:
+            index = rect.collidelist(merged)
+            while index != -1:  # Absorb every rect this one overlaps
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
     def text(self, txt: str or int, size: int, colour='White', bold=True, draw=True, **kwargs)\
             -> tuple[pg.surface.Surface, pg.rect.Rect]:
         """
@@ -80,27 +447,31 @@ class Ui:
         :param bold: Render in bold
         :param draw: Draw to display automatically
         :param kwargs: Arguments for pg.rect
-        :return: A surface, rect tuple for blit
+        :return: A surface, rect tuple for blit (the surface is shared, copy before modifying)
         """
         colour = Colour[colour]
-        path = Ui._Assets + 'boldfont.ttf' if bold else Ui._Assets + 'thinfont.ttf'
-        name = str(size) + path
-
-        try:  # Cache loaded fonts in map
-            loaded_font = Ui._Fonts[name]
-        except KeyError:
-            try:
-                loaded_font = pg.font.Font(path, size)
-            except FileNotFoundError or PermissionError:
-                Log("UI").log("Failed to load font", LogLevel.WRN, "path: " + path)
-                loaded_font = pg.font.Font(None, size)
-            Ui._Fonts[name] = loaded_font
-
-        surf = loaded_font.render(txt, True, colour)  # Render the text
+        key = txt, size, tuple(colour), bold
+
+        surf = Ui._Text.get(key)  # Reuse previously rendered text
+        if surf is None:
+            path = Ui._Assets + 'boldfont.ttf' if bold else Ui._Assets + 'thinfont.ttf'
+            name = str(size) + path
+
+            loaded_font = Ui._Fonts.get(name)  # Cache loaded fonts in map
+            if loaded_font is None:
+                try:
+                    loaded_font = pg.font.Font(path, size)
+                except FileNotFoundError or PermissionError:
+                    Log("UI").log("Failed to load font", LogLevel.WRN, "path: " + path)
+                    loaded_font = pg.font.Font(None, size)
+                Ui._Fonts.put(name, loaded_font)
+
+            surf = loaded_font.render(txt, True, colour)  # Render the text
+            Ui._Text.put(key, surf)
         rect = surf.get_rect(**kwargs)
 
         if draw:
-            self.Display.blit(surf, rect)
+            self.blit(surf, rect, key=('text',) + key)
         return surf, rect  # Return surf rect pair with kwargs
 
     def bar(self, size: tuple[int, int], value: float, min_value: float, max_value: float, border_width=2,
@@ -117,45 +488,69 @@ class Ui:
         :param border_colour: Bar outside colour
         :param draw: Automatically draw to display
         :param kwargs: Arguments for pg.rect
-        :return: A surface, rect tuple for blit
+        :return: A surface, rect tuple for blit (a copy if draw is False, the drawn surface is shared by the style)
         """
         fill_colour = Colour[fill_colour]
         border_colour = Colour[border_colour]
         value = float(value)
+        size = tuple(size)
 
-        surf = pg.surface.Surface((size[0], size[1]))
-        surf.fill((1, 1, 1))
-        surf.set_colorkey((1, 1, 1))
-
+        # Quantize the value into the pixels it changes, the rest of the bar is reused
         if min_value < 0:
             min_value = -min_value  # Convert min value to positive number
 
-            ratio = ((size[0] - border_width - 1) / (max_value + min_value)) * (value + min_value)
+            fill = 0
             if value > 0 - min_value:  # Handle negative values
-                pg.draw.line(surf, fill_colour, (border_width, (size[1] / 2) - 1),
-                             (ratio, (size[1] / 2) - 1), width=(size[1] - border_width * 2))
+                fill = round(((size[0] - border_width - 1) / (max_value + min_value)) * (value + min_value))
 
-            ratio = round((size[0] - border_width - 1) / max_value * value)
-            if value > min_value and ratio > border_width:
-                pg.draw.line(surf, Colour['white'] if value < 0 else Colour['grey'],
-                             (ratio, border_width), (ratio, size[1] - border_width))
+            marker = round((size[0] - border_width - 1) / max_value * value)
+            if not (value > min_value and marker > border_width):
+                marker = 0
+            fill_key = fill, marker, value < 0
 
         else:
             try:
-                ratio = round((size[0] - border_width - 1) / max_value * value)
+                fill = round((size[0] - border_width - 1) / max_value * value)
             except ZeroDivisionError:
-                ratio = 0
-            if value > min_value and ratio > border_width:
+                fill = 0
+            if not (value > min_value and fill > border_width):
+                fill = 0
+            fill_key = fill, 0, False
+
+        widget_key = 'bar', size, border_width, border_radius, tuple(fill_colour), tuple(border_colour)
+        widget = Ui._Widgets.get(widget_key)
+        if widget is None:  # Create the surface and border once per bar style
+            border = pg.surface.Surface(size)
+            border.fill(Colour['Key'])
+            border.set_colorkey(Colour['Key'])
+            pg.draw.rect(border, border_colour, (0, 0, size[0], size[1]), width=border_width,
+                         border_radius=border_radius)
+
+            surf = pg.surface.Surface(size)
+            surf.set_colorkey(Colour['Key'])
+
+            widget = [surf, border, None]  # Surface, border, drawn fill
+            Ui._Widgets.put(widget_key, widget)
+
+        surf, border, drawn = widget
+        if drawn != fill_key:  # Only redraw the fill when it moves
+            fill, marker, negative = fill_key
+            surf.fill(Colour['Key'])
+            if fill:
                 pg.draw.line(surf, fill_colour, (border_width, (size[1] / 2) - 1),
-                             (ratio, (size[1] / 2) - 1), width=size[1] - border_width * 2)
-
-        pg.draw.rect(surf, border_colour, (0, 0, size[0], size[1]), width=border_width, border_radius=border_radius)
+                             (fill, (size[1] / 2) - 1), width=size[1] - border_width * 2)
+            if marker:
+                pg.draw.line(surf, Colour['White'] if negative else Colour['Grey'],
+                             (marker, border_width), (marker, size[1] - border_width))
+            surf.blit(border, (0, 0))
+            widget[2] = fill_key
 
         rect = surf.get_rect(**kwargs)
 
         if draw:
-            self.Display.blit(surf, rect)
-        return surf, rect
+            self.blit(surf, rect, key=widget_key + fill_key)
+            return surf, rect
+        return surf.copy(), rect  # The shared surface is redrawn by the next bar of the same style
 
     def button(self, state: bool or str or None, size=(70, 35), draw=True, **kwargs)\
             -> tuple[pg.surface.Surface, pg.rect.Rect]:
@@ -164,50 +559,58 @@ class Ui:
         :param size: The size of the button
         :param draw: Automatically draw to display
         :param kwargs: Arguments for pg.rect
-        :return: A surface, rect tuple for blit
+        :return: A surface, rect tuple for blit (the surface is shared, copy before modifying)
         """
+        widget_key = 'button', type(state), state, tuple(size)  # Type included as True == 1
+        surface = Ui._Widgets.get(widget_key)
+        if surface is None:  # Draw each state once
+            surface = pg.transform.scale(self._draw_button(state), size)
+            Ui._Widgets.put(widget_key, surface)
+
+        rect = surface.get_rect(**kwargs)
+
+        if draw:
+            self.blit(surface, rect, key=widget_key)
+        return surface, rect
+
+    def _draw_button(self, state: bool or str or None) -> pg.surface.Surface:
         surface = pg.surface.Surface((64, 32))
-        surface.fill(Colour['key'])
-        surface.set_colorkey(Colour['key'])
+        surface.fill(Colour['Key'])
+        surface.set_colorkey(Colour['Key'])
 
         shade = pg.surface.Surface((64, 32))  # SHADING
-        shade.fill(Colour['key'])
-        shade.set_colorkey(Colour['key'])
+        shade.fill(Colour['Key'])
+        shade.set_colorkey(Colour['Key'])
         shade.set_alpha(100)
         if type(state) is str:
             color = Colour[state]
         else:
             if state:
-                color = Colour['l green']
+                color = Colour['LGreen']
             elif state is None:
-                color = Colour['grey']
+                color = Colour['Grey']
             else:
-                color = Colour['red']
+                color = Colour['Error']
         pg.draw.circle(shade, color, (16, 16), 14, draw_top_left=True, draw_bottom_left=True)
         pg.draw.rect(shade, color, (16, 2, 32, 28))
         pg.draw.circle(shade, color, (48, 16), 14, draw_top_right=True, draw_bottom_right=True)
 
         if state and type(state) is bool:  # PIN
-            pg.draw.circle(surface, Colour['white'], (48, 16), 12, width=2)
-            pg.draw.circle(surface, Colour['green'], (48, 16), 10)
+            pg.draw.circle(surface, Colour['White'], (48, 16), 12, width=2)
+            pg.draw.circle(surface, Colour['Green'], (48, 16), 10)
         elif state is None or type(state) is tuple:
-            surface.blit(*self.text('Press', 18, bold=True, center=surface.get_rect().center))
+            surface.blit(*self.text('Press', 18, bold=True, draw=False, center=surface.get_rect().center))
         else:
-            pg.draw.circle(surface, Colour['white'], (16, 16), 12, width=2)
-            pg.draw.circle(surface, Colour['red'], (16, 16), 10)
+            pg.draw.circle(surface, Colour['White'], (16, 16), 12, width=2)
+            pg.draw.circle(surface, Colour['Error'], (16, 16), 10)
 
-        pg.draw.circle(surface, Colour['white'], (16, 16), 16, width=2, draw_top_left=True,
+        pg.draw.circle(surface, Colour['White'], (16, 16), 16, width=2, draw_top_left=True,
                        draw_bottom_left=True)  # BORDER
-        pg.draw.line(surface, Colour['white'], (16, 0), (48, 0), width=2)
-        pg.draw.line(surface, Colour['white'], (16, 30), (48, 30), width=2)
-        pg.draw.circle(surface, Colour['white'], (48, 16), 16, width=2, draw_top_right=True, draw_bottom_right=True)
-
-        surface = pg.transform.scale(surface, size)
-        rect = surface.get_rect(**kwargs)
+        pg.draw.line(surface, Colour['White'], (16, 0), (48, 0), width=2)
+        pg.draw.line(surface, Colour['White'], (16, 30), (48, 30), width=2)
+        pg.draw.circle(surface, Colour['White'], (48, 16), 16, width=2, draw_top_right=True, draw_bottom_right=True)
 
-        if draw:
-            self.Display.blit(surface, rect)
-        return surface, rect
+        return surface
 
     def show_info(self, txt: str, colour='Grey', timeout=3000, force=False) -> None:
         """
@@ -221,6 +624,7 @@ class Ui:
 
         if not self._info[0] or force:  # If not showing another message
             self._info = txt, colour, pg.time.get_ticks() + timeout if timeout != 0 else timeout
+            FrameScheduler.wake()  # May be called from other threads
 
     def clear_info(self) -> None:
         self._info = "", 'Grey', 0
@@ -240,6 +644,16 @@ class Ui:
     def add_colours(colours: dict) -> None:
         Colour.update(colours)
 
+    @staticmethod
+    def sizeof(value: pg.surface.Surface or list or tuple) -> int:
+        """
+        :param value: A surface or collection of surfaces
+        :return: The size of the pixel data in bytes
+        """
+        if isinstance(value, pg.surface.Surface):
+            return value.get_pitch() * value.get_height()
+        return sum(Ui.sizeof(item) for item in value if isinstance(item, (pg.surface.Surface, list, tuple)))
+
     @staticmethod
     def load_image(path: str, size=(0, 0), keep_alpha=True, smooth_scale=True) -> pg.surface.Surface:
         img = pg.image.load(path)
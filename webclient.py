@@ -0,0 +1,144 @@
+from log import *
+from urllib.parse import urlsplit
+import threading
+import time
+
+requests = None  # To call http requests, imported on first use as it is slow to import (see _import_requests())
+
+
+class HttpClient(Log):
+    _POOL_HOSTS = 4  # Hosts to keep connection pools for
+    _POOL_SIZE = 4  # Open connections kept per host
+    _TIMEOUT = 10  # Default request timeout (s)
+
+    _RETRY_ATTEMPTS = 2  # Retries allowed per request
+    _RETRY_RATIO = 0.1  # Retry budget earned per request
+    _RETRY_BUDGET = 5  # Maximum retries saved up
+
+    def __init__(self):
+        """
+        Shared HTTP client for windows and plugins.
+        Keeps connections to each host open between requests (no DNS lookup or handshake per request),
+        retries failed requests within a budget and records metrics per endpoint.
+        """
+        super().__init__('Http')
+        self._session = None  # Created by the first request
+
+        self._lock = threading.Lock()
+        self._timeouts = {}  # Timeout per endpoint -> { 'url prefix': seconds }
+        self._retry_budget = self._RETRY_BUDGET  # Retries that can be made (shared by all requests)
+        self._metrics = {}  # Metrics per endpoint -> { 'url': {...} }
+
+    def set_timeout(self, url: str, timeout: float) -> None:
+        """
+        :param url: Endpoint or url prefix (eg. "http://host:1880/endpoint/spotify")
+        :param timeout: Timeout for requests to urls starting with url (s)
+        """
+        self._timeouts[url] = timeout
+
+    def get(self, url: str, params=None, headers=None, timeout=None, stream=False) -> 'requests.Response':
+        """
+        Sends a GET request, retrying connection errors and server errors whilst the retry budget allows
+        :param url: The url to request
+        :param params: Query parameters
+        :param headers: Extra request headers
+        :param timeout: Timeout (s), defaults to the endpoint timeout
+        :param stream: Do not download the body straight away (use response.iter_content())
+        :return: The response
+        """
+        session = self._get_session()
+        endpoint = self._endpoint(url)
+        if timeout is None:
+            timeout = self._get_timeout(url)
+
+        with self._lock:
+            self._retry_budget = min(self._retry_budget + self._RETRY_RATIO, self._RETRY_BUDGET)
+
+        attempt = 0
+        while True:
+            timestamp = time.perf_counter()
+            try:
+                response = session.get(url, params=params, headers=headers, timeout=timeout, stream=stream)
+                if response.status_code < 500 or not self._use_retry(attempt):
+                    break
+                response.close()
+                self.log("Server error, retrying", LogLevel.WRN, data="code: " + str(response.status_code) +
+                                                                      ", url: " + endpoint)
+
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if not self._use_retry(attempt):
+                    self._record(endpoint, time.perf_counter() - timestamp, 0, error=True, retries=attempt)
+                    raise
+                self.log("Request failed, retrying", LogLevel.WRN, data=str(err))
+            attempt += 1
+
+        size = int(response.headers.get('Content-Length', 0)) if stream else len(response.content)
+        self._record(endpoint, time.perf_counter() - timestamp, size, error=response.status_code >= 400,
+                     retries=attempt)
+        return response
+
+    def get_stats(self) -> dict:
+        """
+        :return: Metrics per endpoint -> { 'url': { requests, errors, retries, bytes, avg_ms, max_ms } }
+        """
+        with self._lock:
+            stats = {}
+            for endpoint, metrics in self._metrics.items():
+                stats[endpoint] = dict(metrics)
+                stats[endpoint]['avg_ms'] = metrics['total_ms'] / metrics['requests'] if metrics['requests'] else 0
+            return stats
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+        self.log("Closed", LogLevel.INF, data=str(self.get_stats()))
+
+    def _get_session(self) -> 'requests.Session':
+        with self._lock:
+            if self._session is None:
+                _import_requests()
+                self._session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self._POOL_HOSTS, pool_maxsize=self._POOL_SIZE)
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            return self._session
+
+    def _use_retry(self, attempt: int) -> bool:
+        with self._lock:
+            if attempt >= self._RETRY_ATTEMPTS or self._retry_budget < 1:
+                return False
+            self._retry_budget -= 1
+            return True
+
+    def _get_timeout(self, url: str) -> float:
+        match = ''
+        for prefix in self._timeouts:  # Longest matching prefix wins
+            if url.startswith(prefix) and len(prefix) > len(match):
+                match = prefix
+        return self._timeouts[match] if match else self._TIMEOUT
+
+    def _record(self, endpoint: str, latency: float, size: int, error=False, retries=0) -> None:
+        with self._lock:
+            metrics = self._metrics.setdefault(endpoint, {'requests': 0, 'errors': 0, 'retries': 0, 'bytes': 0,
+                                                          'total_ms': 0.0, 'max_ms': 0.0})
+            latency *= 1000
+            metrics['requests'] += 1
+            metrics['errors'] += error
+            metrics['retries'] += retries
+            metrics['bytes'] += size
+            metrics['total_ms'] += latency
+            metrics['max_ms'] = max(metrics['max_ms'], latency)
+
+    @staticmethod
+    def _endpoint(url: str) -> str:
+        parts = urlsplit(url)
+        return parts.scheme + '://' + parts.netloc + parts.path  # Without query
+
+
+def _import_requests() -> None:
+    """
+    Imports requests into this module, it takes longer to import than the rest of the program
+    """
+    global requests
+    if requests is None:
+        import requests.adapters  # Binds the requests package
@@ -1,14 +1,17 @@
 ﻿from ui import *
-from mqtt import MqttClient
+from mqtt import MqttClient, InboxPolicy
+from webclient import HttpClient
 import json  # To decode messages from MQTT (used by subclasses)
 
 class WindowBase(Log):
     _Mqtt = MqttClient
     _Ui = Ui
+    _Http = HttpClient
 
     def __init__(self, name: str):
         super().__init__(name)
         self._is_active = False
+        self._is_opaque = False  # Set if draw() always covers the whole screen (skips clearing it)
 
     @staticmethod
     def set_mqtt(mqtt: MqttClient):
@@ -18,6 +21,10 @@ class WindowBase(Log):
     def set_ui(ui: Ui):
         WindowBase._Ui = ui
 
+    @staticmethod
+    def set_http(http: HttpClient):
+        WindowBase._Http = http
+
     def _start(self) -> None:
         """
         To be overwritten by subclasses.
@@ -64,6 +71,9 @@ class WindowBase(Log):
         self._is_active = False
         self.log('Stopped', LogLevel.INF)
 
+    def is_opaque(self) -> bool:
+        return self._is_opaque
+
     def draw(self) -> None:
         """
         Draws the window to the screen
@@ -76,3 +86,12 @@ class WindowBase(Log):
         Update the window (run inputs, updates, etc)
         """
         pass
+
+    def get_deadline(self) -> int or None:
+        """
+        To be overwritten by subclasses.\n
+        The next time (ms) the window will change without an event, eg. a timer ticking over.\n
+        The main loop sleeps until then, use FrameScheduler.burst() for animations
+        :return: Timestamp from pg.time.get_ticks(), or None if nothing is scheduled
+        """
+        return None
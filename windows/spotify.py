@@ -1,8 +1,111 @@
 ﻿from window import *  # Window base class
+from loader import ImageLoader, ImageQueue
+from cache import DiskCache, TtlCache
+from state import StateDiff
 
 import io  # To decode http requests
-import requests  # To call http requests
 import threading  # To load playlists on start
+import hashlib  # To version playlists
+
+
+class PlaylistStore(Log):
+    def __init__(self, path: str):
+        """
+        The user's playlists, indexed by uri and saved to disk between runs.
+        Remembers the version it holds so refreshing an unchanged library is a single small request.
+        :param path: File to save / load the playlists
+        """
+        super().__init__('Spotify playlists')
+        self._path = path
+        self._data = [], {}  # Playlists in library order, { uri: index } (swapped together)
+        self._version = {'etag': None, 'last_modified': None, 'hash': None}  # Identifies the stored library
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._data[0])
+
+    def __getitem__(self, index: int) -> dict:
+        return self._data[0][index]
+
+    def index(self, uri: str) -> int:
+        """
+        :param uri: The uri of the playlist
+        :return: The index of the playlist, or -1 if not found
+        """
+        return self._data[1].get(uri, -1)
+
+    def get_headers(self) -> dict:
+        """
+        :return: Headers to only download the library if it has changed
+        """
+        headers = {}
+        if not self._data[0]:  # Nothing stored to keep, download the whole library
+            return headers
+        if self._version['etag'] or self._version['hash']:  # Fall back to the content hash if no ETag was given
+            headers['If-None-Match'] = self._version['etag'] or '"' + self._version['hash'] + '"'
+        if self._version['last_modified']:
+            headers['If-Modified-Since'] = self._version['last_modified']
+        return headers
+
+    def update(self, content: bytes, headers: dict) -> bool:
+        """
+        Replaces the library with a response from Node-RED
+        :param content: The response body
+        :param headers: The response headers
+        :return: If the library changed
+        """
+        content_hash = hashlib.sha1(content).hexdigest()
+        if content_hash == self._version['hash']:  # Same as stored, no need to decode
+            self._version['etag'] = headers.get('ETag')
+            self._version['last_modified'] = headers.get('Last-Modified')
+            return False
+
+        content = json.loads(content)
+        playlists = content['items'] if 'items' in content.keys() else [content]
+        self._data = playlists, {playlist['uri']: index for index, playlist in enumerate(playlists)}
+        # Only remember the version once it has been applied, so a failed decode is downloaded again
+        self._version['hash'] = content_hash
+        self._version['etag'] = headers.get('ETag')
+        self._version['last_modified'] = headers.get('Last-Modified')
+        self.save()
+        return True
+
+    def add(self, playlist: dict) -> None:
+        """
+        Adds or replaces a single playlist
+        :param playlist: The playlist to add
+        """
+        playlists, index = list(self._data[0]), dict(self._data[1])
+        if playlist['uri'] in index:
+            playlists[index[playlist['uri']]] = playlist
+        else:
+            index[playlist['uri']] = len(playlists)
+            playlists.append(playlist)
+        self._data = playlists, index
+        self._version['hash'] = None  # No longer matches a library version
+        self.save()
+
+    def load(self) -> None:
+        try:
+            with open(self._path, 'r') as file:
+                snapshot = json.load(file)
+            playlists = snapshot['items']
+            self._data = playlists, {playlist['uri']: index for index, playlist in enumerate(playlists)}
+            self._version.update(snapshot['version'])
+            self.log("Loaded playlists", LogLevel.INF, data="count: " + str(len(playlists)))
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            self.handle(err, trace=False)
+            self.log("Could not read playlists", LogLevel.WRN, data="path: " + self._path)
+
+    def save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            with open(self._path, 'w') as file:
+                json.dump({'version': self._version, 'items': self._data[0]}, file)
+        except Exception as err:
+            self.handle(err, trace=False)
 
 
 class SpotifyWindow(WindowBase):
@@ -11,11 +114,20 @@ class SpotifyWindow(WindowBase):
     _mqtt_response = 'miniplayer/spotify/response'
 
     _nodered_url = "http://homeassistant.local:1880/endpoint"  # Node-red HTTP request
+    _cache_folder = 'cache'  # Album covers, liked songs and playlists
+
+    _cover_cache_size = 128 * 1024 * 1024  # Album covers kept on disk (bytes)
+    _liked_cache_ttl = 6 * 60 * 60  # Time before liked songs are checked again (s)
+    _thumbnail_size = (64, 64)  # Playlist cover size in the playlist menu
+    _thumbnail_pages = 2  # Atlas pages of playlist covers kept in memory (256 covers, 4MB each)
+    _thumbnail_preload = 4  # Playlist covers loaded above / below the visible rows
+    _plist_scroll_speed = 1500  # Playlist menu scroll button speed (px/s)
 
     _guideline_mode = False  # Changes UI to adhere to spotify guidelines (https://developer.spotify.com/documentation/design#playing-views)
 
     def __init__(self):
         super().__init__('Spotify')
+        self._is_opaque = True  # Always draws a full screen layer
 
         self._Ui.add_colours({  # Add custom colours to Ui
             'Spotify': pg.Color(30, 215, 96)
@@ -58,13 +170,19 @@ class SpotifyWindow(WindowBase):
             'plist': {
                 'button': self._Ui.load_image('assets\\spotify\\playlist_1.png'),
                 'background': pg.surface.Surface((self._Ui.Width, self._Ui.Height)),
-                'cross': self._Ui.load_image('assets\\ui\\cross.png')
+                'cross': self._Ui.load_image('assets\\ui\\cross.png'),
+                'scroll_u': pg.surface.Surface((50, 50), pg.SRCALPHA),
+                'scroll_d': pg.surface.Surface((50, 50), pg.SRCALPHA)
             }
         })
 
         # Set playlist background to transparent
         self._surf['plist']['background'].set_alpha(150)
 
+        # Draw playlist scroll arrows
+        pg.draw.polygon(self._surf['plist']['scroll_u'], Colour['White'], ((25, 12), (42, 38), (8, 38)))
+        pg.draw.polygon(self._surf['plist']['scroll_d'], Colour['White'], ((25, 38), (42, 12), (8, 12)))
+
         # Draw rounded rect to album cover
         self._surf['album_cover'].fill(pg.Color(0, 0, 0, 0))
         self._surf['album_cover'].set_alpha(130)
@@ -96,9 +214,23 @@ class SpotifyWindow(WindowBase):
         self._rect['plist'].update({'button': media_surf.get_rect(topright=(self._rect['shuffle'].left - 50, top))})
         self._rect.update({'skip': media_surf.get_rect(topleft=(self._rect['pause'].right + 50, top))})
         self._rect.update({'repeat': media_surf.get_rect(topleft=(self._rect['skip'].right + 50, top))})
+        self._rect['progress'] = pg.rect.Rect(0, self._rect['pause'].bottom + 40 + 8 - 25, self._Ui.Width, 50)  # Bar & timestamps
         self._rect.update({'liked': media_surf.get_rect(topleft=(self._rect['repeat'].right + 50, top))})
 
+        # Playlist menu (only the visible rows are drawn)
+        menu_rect = pg.rect.Rect(self._Ui.Left + 60, self._rect['plist']['scroll_u'].top, 0, 0)
+        menu_rect.width = self._rect['plist']['scroll_u'].left - 40 - menu_rect.left
+        menu_rect.height = self._rect['plist']['scroll_d'].bottom - menu_rect.top
+        self._plist_menu = ScrollList(menu_rect, self._thumbnail_size[1] + 16)
+        self._plist_range = range(0)  # Rows that playlist covers were last requested for
+
         # Song data
+        self._Http.set_timeout(self._nodered_url + "/spotify/liked", 5)
+        self._Http.set_timeout(self._nodered_url + "/spotify/playlist", 15)
+
+        self._cover_loader = ImageLoader('Spotify cover loader', self._Http)  # Downloads album covers off the MQTT thread
+        self._cover_cache = DiskCache('Spotify cover cache', os.path.join(self._cache_folder, 'spotify'),
+                                      self._cover_cache_size)
         self._is_cover_loaded = False
         self._is_active = False  # If song is open/active
         self._is_playing = None  # If song is playing
@@ -145,12 +277,29 @@ class SpotifyWindow(WindowBase):
             'params': []
         }
 
+        # Work done per message, only run when the fields it uses change
+        self._state = StateDiff('Spotify state')
+        self._state.subscribe('item.album.images', self._on_cover)
+        self._state.subscribe('device', self._on_device)
+        self._state.subscribe(('item.name', 'item.album.name', 'item.duration_ms'), self._on_song)
+        self._state.subscribe('progress_ms', self._on_progress)
+        self._state.subscribe('item.artists', self._on_artists)
+        self._state.subscribe('is_playing', self._on_playing)
+        self._state.subscribe('shuffle_state', self._on_shuffle)
+        self._state.subscribe('context', self._on_context)
+        self._state.subscribe('item.id', self._on_track)
+
         self._liked_thread = threading.Thread(name='spotify_fetch_liked', target=self._fetch_liked_song)
+        self._liked_cache = TtlCache('Spotify liked cache', self._liked_cache_ttl,
+                                     os.path.join(self._cache_folder, 'spotify_liked.json'))  # { track id: liked }
+        self._liked_track = ''  # Track id that self._is_liked belongs to
         self._is_liked = None
 
-        # TODO: Playlist image loading/cache/sorting
+        # TODO: Playlist sorting
+        self._thumbnails = TextureAtlas(self._thumbnail_size, max_pages=self._thumbnail_pages)  # { uri: cover }
+        self._thumbnail_loader = ImageQueue('Spotify thumbnail loader', self._Http)
         self._playlist_thread = threading.Thread(name='spotify_fetch_playlists', target=self._fetch_playlists)
-        self._playlists = []  # Playlists
+        self._playlists = PlaylistStore(os.path.join(self._cache_folder, 'spotify_playlists.json'))  # Playlists
         self._current_playlist = -1  # Index of current playlist in self._playlists (-1!)
         self._view_playlists = False
         self._playlist_liked_songs = False
@@ -164,15 +313,53 @@ class SpotifyWindow(WindowBase):
         self._progress_timestamp = 0  # Timestamp of last progress update
 
     def draw(self) -> None:
+        if self._view_playlists:  # Everything behind the menu is flattened and dimmed, only the rows are drawn
+            self._Ui.layer('spotify', ('menu',) + self._get_static_key() + self._get_dynamic_key(),
+                           self._draw_menu_background)
+            if self._is_active:  # Changes every second, kept in its own strip so the menu layer is not rebuilt
+                self._Ui.layer('spotify progress', self._get_progress_key() + self._get_static_key(),
+                               self._draw_menu_progress, area=self._rect['progress'])
+            self._draw_playlist_menu()
+            return
+
+        self._Ui.layer('spotify', self._get_static_key(), self._draw_static)  # Only redrawn on track / state changes
+        if self._is_active:
+            self._draw_dynamic()
+
+    def _get_static_key(self) -> tuple:
+        return (self._is_active, self._is_cover_loaded, id(self._surf['background']), id(self._surf['album_cover']),
+                self._response['item']['name'], self._artists, self._response['item']['album']['name'],
+                self._response['item']['explicit'], self._is_liked, self._view_playlists, len(self._playlists),
+                self._current_playlist, self._playlist_liked_songs, self._get_playlist_name())
+
+    def _get_dynamic_key(self) -> tuple:  # Button states, the progress is not part of any layer
+        return (self._is_playing, self._is_shuffle,
+                tuple(value for value in self._actions.values() if type(value) is int))
+
+    def _get_progress_key(self) -> tuple:
+        return self._progress_ms, self._duration_ms, self._progress, self._duration
+
+    def _get_playlist_name(self) -> str:
+        """
+        :return: Name of the playlist (or liked songs) playing, shown next to the playlist button
+        """
+        if -1 < self._current_playlist < len(self._playlists):
+            return self._playlists[self._current_playlist]['name']
+        return "Liked Songs" if self._playlist_liked_songs else ''
+
+    def _draw_static(self) -> None:
+        """
+        Draws the parts of the window that only change with the track or state (flattened into a layer)
+        """
         if self._is_cover_loaded:
-            self._Ui.Display.blit(self._surf['background'], (0, 0))
+            self._Ui.blit(self._surf['background'], (0, 0))
         else:
             self._Ui.background()
 
-        self._Ui.Display.blit(self._surf['logo'], self._rect['logo'])
+        self._Ui.blit(self._surf['logo'], self._rect['logo'])
 
         # Album cover
-        self._Ui.Display.blit(self._surf['album_cover'], self._rect['album_cover'])
+        self._Ui.blit(self._surf['album_cover'], self._rect['album_cover'])
 
         # Song, Artist, Album name
         txt = self._Ui.text(self._response['item']['name'], 35, bold=True,
@@ -190,39 +377,90 @@ class SpotifyWindow(WindowBase):
         # Explicit icon
         if self._response['item']['explicit']:
             self._rect['explicit'].midleft = (txt[1].right + 15, txt[1].centery)
-            self._Ui.Display.blit(self._surf['explicit'], self._rect['explicit'])
+            self._Ui.blit(self._surf['explicit'], self._rect['explicit'])
+
+        # Buttons that do not show a pressed state
+        self._Ui.blit(self._surf['repeat'][1], self._rect['repeat'])  # Repeat
+        if type(self._is_liked) is bool:
+            self._Ui.blit(self._surf['liked'][self._is_liked], self._rect['liked'])  # Liked
+        if not self._view_playlists and self._playlists:
+            self._Ui.blit(self._surf['plist']['button'], self._rect['plist']['button'])  # Playlist button
+            name = self._get_playlist_name()
+            if name:  # If current song is in a playlist (or liked songs)
+                self._Ui.text(name, 20, colour="Grey", bold=False,  # Playlist name
+                              midright=(self._rect['plist']['button'].left - 25, self._rect['plist']['button'].centery))
 
-        # Progress bar & timestamps
+    def _draw_dynamic(self) -> None:
+        """
+        Draws the parts of the window that change during playback or on input (drawn every frame)
+        """
+        self._draw_progress()
+        self._draw_buttons()
+
+    def _draw_progress(self) -> None:
+        """
+        Draws the progress bar & timestamps (within self._rect['progress'])
+        """
         bar = self._Ui.bar((800, 16), self._progress_ms, 0, self._duration_ms,
                      midtop=(self._Ui.Center[0], self._rect['pause'].bottom + 40))
         self._Ui.text(self._progress, 30, midright=(bar[1].left - 30, bar[1].centery + 1))
         self._Ui.text(self._duration, 30, midleft = (bar[1].right + 30, bar[1].centery + 1))
 
-        # Buttons
-        self._Ui.Display.blit(self._surf['pause' if self._is_playing else 'play']
+    def _draw_buttons(self) -> None:
+        self._Ui.blit(self._surf['pause' if self._is_playing else 'play']
                               [not (self._actions['pause'] or self._actions['play'])], self._rect['pause'])  # Pause/Play
-        self._Ui.Display.blit(self._surf['skip'][not self._actions['skip']], self._rect['skip'])  # Skip
-        self._Ui.Display.blit(self._surf['rewind'][not self._actions['rewind']], self._rect['rewind'])  # Rewind
-        self._Ui.Display.blit(self._surf['shuffle_active' if self._is_shuffle else 'shuffle']
+        self._Ui.blit(self._surf['skip'][not self._actions['skip']], self._rect['skip'])  # Skip
+        self._Ui.blit(self._surf['rewind'][not self._actions['rewind']], self._rect['rewind'])  # Rewind
+        self._Ui.blit(self._surf['shuffle_active' if self._is_shuffle else 'shuffle']
                               [not self._actions['shuffle']], self._rect['shuffle'])  # Shuffle
-        self._Ui.Display.blit(self._surf['repeat'][1], self._rect['repeat'])  # Repeat
-        if type(self._is_liked) is bool:
-            self._Ui.Display.blit(self._surf['liked'][self._is_liked], self._rect['liked'])  # Liked
-        if not self._view_playlists and self._playlists:
-            self._Ui.Display.blit(self._surf['plist']['button'], self._rect['plist']['button'])  # Playlist button
-            if self._current_playlist > -1:  # If current song is in playlist
-                self._Ui.text(self._playlists[self._current_playlist]['name'], 20, colour="Grey", bold=False,  # Playlist name
-                              midright=(self._rect['plist']['button'].left - 25, self._rect['plist']['button'].centery))
-            elif self._playlist_liked_songs:
-                self._Ui.text("Liked Songs", 20, colour="Grey", bold=False,  # Liked songs
-                              midright=(self._rect['plist']['button'].left - 25, self._rect['plist']['button'].centery))
 
-        # TODO: Playlist menu
-        if self._view_playlists:
-            self._Ui.Display.blit(self._surf['plist']['background'], (0, 0))
-            self._Ui.Display.blit(self._surf['plist']['cross'], self._rect['plist']['cross'])
+    def _draw_menu_background(self) -> None:
+        """
+        Draws the window dimmed behind the playlist menu (flattened into a layer)
+        """
+        self._draw_static()
+        if self._is_active:
+            self._draw_buttons()  # The progress is drawn on top of the layer, it changes every second
+
+        self._Ui.blit(self._surf['plist']['background'], (0, 0))
+        self._Ui.blit(self._surf['plist']['cross'], self._rect['plist']['cross'])
+        self._Ui.blit(self._surf['plist']['scroll_u'], self._rect['plist']['scroll_u'])
+        self._Ui.blit(self._surf['plist']['scroll_d'], self._rect['plist']['scroll_d'])
+
+    def _draw_menu_progress(self) -> None:
+        """
+        Draws the progress dimmed behind the playlist menu (flattened into a layer of self._rect['progress'])
+        """
+        self._draw_static()  # Clipped to the strip, only the background is behind the progress
+        self._draw_progress()
+        self._Ui.blit(self._surf['plist']['background'], (0, 0))
+
+    def _draw_playlist_menu(self) -> None:
+        menu = self._plist_menu
+        self._Ui.Display.set_clip(menu.rect)  # Cut off rows partly scrolled out
+        for index in menu.get_visible():
+            playlist = self._playlists[index]
+            rect = menu.get_row_rect(index)
+            key = playlist['uri'], playlist['name'], index == self._current_playlist
+            self._Ui.blit(menu.get_row(index, key, self._draw_playlist_row), rect, key=('plist',) + key)
+
+            thumbnail = self._thumbnails.get(playlist['uri'])  # Drawn straight from the atlas
+            if thumbnail is not None:
+                self._Ui.blit(thumbnail[0], (rect.left, rect.top + 8), key=('plist cover', playlist['uri']),
+                              area=thumbnail[1])
+        self._Ui.Display.set_clip(None)
 
     def update(self) -> None:
+        # Swap in the album cover once loaded
+        cover = self._cover_loader.poll()
+        if cover is not None and cover[0] == self._response['item']['album']['images'][0]['url']:
+            self._surf['album_cover'], self._surf['background'] = cover[1]  # Update to show new images
+            self._is_cover_loaded = True
+            self.log("Album artwork loaded successfully!", LogLevel.INF)
+
+        for uri, thumbnail in self._thumbnail_loader.poll():  # Pack loaded playlist covers into the atlas
+            self._thumbnails.add(uri, thumbnail)
+
         # Update progress bar (every second)
         if self._is_playing and pg.time.get_ticks() - self._progress_timestamp >= 1000:  # Increment /s
             self._progress_ms += pg.time.get_ticks() - self._progress_timestamp
@@ -238,16 +476,20 @@ class SpotifyWindow(WindowBase):
         if (self._is_active and not self._view_playlists and self._playlists and
                 self._Ui.input(self._rect['plist']['button'])):  # Playlist
             self._view_playlists = True
+            self._plist_range = range(0)  # Load covers of the first rows
             self.log("Opened playlist menu", LogLevel.INF)
 
         elif not self._view_playlists:
-            if self._is_active and type(self._is_liked) is bool and self._Ui.input(self._rect['liked']):  # Liked song
+            if (self._is_active and type(self._is_liked) is bool and not self._liked_thread.is_alive() and
+                    self._Ui.input(self._rect['liked'])):  # Liked song
                 self.log("Liked song pressed, requesting...", LogLevel.INF)
                 self._Ui.show_info("Adding to Liked Songs" if not self._is_liked else "Removing from Liked Songs",
                              colour='Spotify')
-                # Change liked
+                # Change liked (shown straight away, reverted if the request fails)
+                self._is_liked = not self._is_liked
+                self._liked_cache.put(self._liked_track, self._is_liked)
                 self._liked_thread = threading.Thread(name='spotify_fetch_liked', target=self._fetch_liked_song,
-                                                      args=(self._response['item']['id'], not self._is_liked))
+                                                      args=(self._liked_track, self._is_liked))
                 self._liked_thread.start()
 
             if self._is_active and not self._action_pending:  # Check actions
@@ -277,27 +519,57 @@ class SpotifyWindow(WindowBase):
         elif self._view_playlists:
             if self._Ui.input(self._rect['plist']['cross']):  # Cross
                 self._view_playlists = False
+                self._plist_menu.clear()
                 self.log("Closed playlist menu", LogLevel.INF)
+                return
+
+            if self._Ui.input(self._rect['plist']['scroll_u']):  # Scroll buttons
+                self._plist_menu.fling(-self._plist_scroll_speed)
+            elif self._Ui.input(self._rect['plist']['scroll_d']):
+                self._plist_menu.fling(self._plist_scroll_speed)
+
+            self._plist_menu.set_count(len(self._playlists))
+            self._plist_menu.update(self._Ui.mouse_pos, pg.mouse.get_pressed()[0])
+            if self._plist_menu.is_moving():
+                FrameScheduler.burst(100)  # Animate smoothly until stopped
+
+            visible = self._plist_menu.get_visible()
+            if visible != self._plist_range:  # Load covers for rows about to scroll in
+                self._plist_range = visible
+                self._load_thumbnails(visible.start - self._thumbnail_preload, visible.stop + self._thumbnail_preload)
+
+    def get_deadline(self) -> int or None:
+        if self._is_playing:  # Progress ticks over every second
+            return self._progress_timestamp + 1000
+        return None
 
     def _start(self) -> None:
-        self._Mqtt.sub(self._mqtt_response, self._receive)
-        self._Mqtt.pub(self._mqtt_active, { self._Mqtt.get_id(): 1 })  # Send active
-        self._playlists = []  # Clear existing playlists
+        self._Mqtt.set_publish(self._mqtt_active, qos=1)
+        self._Mqtt.set_publish(self._mqtt_action, coalesce=50, rate=4)  # Button mashing sends at most 4/s
+        self._Mqtt.sub(self._mqtt_response, self._receive, InboxPolicy.Latest)  # Only the newest state matters
+        self._Mqtt.pub(self._mqtt_active, { self._Mqtt.get_id(): 1 }, collapse=True)  # Send active
         self._playlist_thread = threading.Thread(name='spotify_fetch_playlists', target=self._fetch_playlists)
         self._playlist_thread.start()  # Load playlists on a thread
 
     def _stop(self) -> None:
+        self._Ui.remove_layer('spotify')
+        self._Ui.remove_layer('spotify progress')
+        self._liked_cache.save()
+        self._cover_cache.save()
+        self.log("Cover cache stats", LogLevel.INF, data=str(self._cover_cache.get_stats()))
         self._Mqtt.unsub(self._mqtt_response)
-        self._Mqtt.pub(self._mqtt_active, { self._Mqtt.get_id(): 0 })
+        self._Mqtt.pub(self._mqtt_active, { self._Mqtt.get_id(): 0 }, collapse=True)
 
     def _receive(self, client, userdata, msg) -> None:
-        self.log("Received a message!", LogLevel.INF)
+        self.log("Received a message!", LogLevel.DBG, every=10)
         if msg.topic != self._mqtt_response:
             return  # Message not for me
 
         msg = json.loads(msg.payload.decode())  # Convert string response to dict (json)
 
         if msg is None:  # Check if currently playing
+            if self._state.is_complete:  # Subscribers expect every field, do not start a state from this
+                self._state.merge({'is_playing': False})
             self._is_playing = False
             self.log("Message was null!", LogLevel.WRN)
             return
@@ -334,12 +606,14 @@ class SpotifyWindow(WindowBase):
             }
 
             # Don't show album artwork
+            self._cover_loader.cancel()
             self._is_cover_loaded = False
 
             # Draw rounded rect to album cover
             self._surf['album_cover'].fill(pg.Color(0, 0, 0, 0))
             self._surf['album_cover'].set_alpha(130)
             pg.draw.rect(self._surf['album_cover'], (0, 0, 0), self._surf['album_cover'].get_rect(), 0, 15)
+            self._Ui.mark_dirty(self._rect['album_cover'])  # Redrawn in place, so not detected automatically
 
             # Reset progress
             self._progress_ms = 0
@@ -351,64 +625,26 @@ class SpotifyWindow(WindowBase):
             self._artists = ""
 
             self._is_active = False
+            self._state.reset()  # Everything is new when a player opens again
             return
 
         if type(msg) != dict:  # Make sure message is dict
-            self.log("Message was not a dict!", LogLevel.WRN, "type: " + str(type(msg)) + ", msg: " + str(msg))
+            self.log("Message was not a dict!", LogLevel.WRN, lambda: "type: " + str(type(msg)) + ", msg: " + str(msg))
             return
 
-        # Spotify is active and either playing or paused, show song info
-
-        # Load album cover (if changed)
-        cover_url = msg['item']['album']['images'][0]['url']
-        if cover_url != self._response['item']['album']['images'][0]['url']:
-            self.log("Fetching album artwork", LogLevel.INF, data="url: " + cover_url)
-
-            screen_size = self._Ui.Width if self._Ui.Width > self._Ui.Height else self._Ui.Height  # Get largest screen dimension (1:1 image)
-            image = pg.transform.smoothscale(pg.image.load(io.BytesIO(
-                requests.get(cover_url).content)), (screen_size, screen_size))  # Download image
-            cover = pg.transform.smoothscale(image, self._rect['album_cover'].size)  # Scale image to album cover
-
-            background = pg.surface.Surface((self._Ui.Width, self._Ui.Height))  # Create surf of screen size (efficient)
-            if not self._guideline_mode:  # Show image as bg
-                background.blit(image, (self._Ui.Center[0] - image.get_rect().center[0],
-                    self._Ui.Center[1] - image.get_rect().center[1]))  # Blit image to screen (centered)
-            else:  # Show most common colour
-                background.fill(image.get_at(image.get_rect().midleft))  # Set bg to colour of artwork at mid-left
-            background.set_alpha(80 if not self._guideline_mode else 100)  # Dim the background
-
-            self._surf['album_cover'] = cover  # Update to show new images
-            self._surf['background'] = background
-            self._response['item']['album']['images'][0]['url'] = cover_url
-            self._is_cover_loaded = True
-            self.log("Album artwork loaded successfully!", LogLevel.INF)
-
-        # Device data
-        self._response['device'] = msg['device']
-
-        # Song name, album name, duration etc...
-        self._response['item']['name'] = self._shorten_name(msg['item']['name'])
-        self._response['item']['duration_ms'] = int(msg['item']['duration_ms'])
-        self._response['progress_ms'] = int(msg['progress_ms'])
-        self._response['item']['album']['name'] = self._shorten_name(msg['item']['album']['name'])
-
-        self._progress_ms = msg['progress_ms']
-        self._duration_ms = msg['item']['duration_ms']
-        self._progress = self._convert_seconds(self._progress_ms // 1000)
-        self._duration = self._convert_seconds(self._duration_ms // 1000)
-
-        # Artist name(s)
-        self._response['item']['artists'] = msg['item']['artists']  # Copy artist data to response (not shown directly)
-        self._artists = self._response['item']['artists'][0]['name']  # Always show first artist
-        for index in range(1, len(self._response['item']['artists'])):  # If >1 artist, show all with ", "
-            self._artists += ", " + self._response['item']['artists'][index]['name']
-
-        self._progress_timestamp = pg.time.get_ticks()  # Refresh timestamp to known time
+        # Spotify is active and either playing or paused, only work on the fields that changed
+        if 'delta' in msg and len(msg) == 1:  # Partial state, only the changed fields (sent by Node-RED if enabled)
+            if not self._state.is_complete:  # Nothing to apply it to, wait for a complete state
+                self.log("Ignored partial state, no complete state received yet", LogLevel.WRN)
+                return
+            changed = self._state.merge(msg['delta'])
+        else:
+            changed = self._state.update(msg)
 
-        # Set UI to show everything
-        self._is_active = True
-        self._response['is_playing'] = msg['is_playing']
-        self._is_playing = self._response['is_playing']
+        # Refresh timestamp to known time, other messages keep the time elapsed since the last progress
+        if StateDiff.is_changed(changed, 'progress_ms') or StateDiff.is_changed(changed, 'is_playing'):
+            self._progress_timestamp = pg.time.get_ticks()
+        self._is_active = True  # Set UI to show everything
 
         # Actions (reset)
         if self._action_pending:  # If waiting for action, check each for result
@@ -416,11 +652,11 @@ class SpotifyWindow(WindowBase):
                 self._actions['pause'] = 0
             if self._actions['play'] and self._is_playing:  # Play
                 self._actions['play'] = 0
-            if self._actions['shuffle'] and msg['shuffle_state'] != self._response['shuffle_state']:  # Shuffle
+            if self._actions['shuffle'] and StateDiff.is_changed(changed, 'shuffle_state'):  # Shuffle
                 self._actions['shuffle'] = 0
-            if self._actions['skip'] and msg['item']['id'] != self._response['item']['id']:  # Skip
+            if self._actions['skip'] and StateDiff.is_changed(changed, 'item.id'):  # Skip
                 self._actions['skip'] = 0
-            if self._actions['rewind'] and msg['item']['id'] != self._response['item']['id']:  # Rewind
+            if self._actions['rewind'] and StateDiff.is_changed(changed, 'item.id'):  # Rewind
                 self._actions['rewind'] = 0
 
             # If all actions have been met, clear pending
@@ -434,36 +670,6 @@ class SpotifyWindow(WindowBase):
                 self._actions['params'].clear()  # Clear params
                 self.log("Actions reset", LogLevel.INF)
 
-        # Sync shuffle state
-        self._response['shuffle_state'] = msg['shuffle_state']
-        self._is_shuffle = self._response['shuffle_state']
-
-        # End of time-critical code, below takes longer to load and is done last
-
-        # TODO: Find current playlist
-        if msg['context'] is not None:
-            if msg['context']['type'] == 'playlist':
-                if self._current_playlist == -1:  # No active playlist
-                    self._find_current_playlist(msg['context']['uri'])
-                elif self._playlists[self._current_playlist]['uri'] == msg['context']['uri']:
-                    pass  # Song is already in current playlist
-                else:  # Active playlist, but doesn't match song
-                    self._find_current_playlist(msg['context']['uri'])
-                self._playlist_liked_songs = False
-            elif msg['context']['type'] == 'collection':
-                self._playlist_liked_songs = True
-                self._current_playlist = -1
-            else:
-                self._current_playlist = -1
-
-        self._response['context'] = msg['context']  # Update context to new
-
-        if msg['item']['id'] != self._response['item']['id']:  # If new song is playing
-            # Warning, blocking function! Takes a second or 2 to complete HTTP request/response
-            self._fetch_liked_song(msg['item']['id'])  # Ask nodered if it is liked or not (already threading so okay to call directly)
-
-        self._response['item']['id'] = msg['item']['id']  # Update current song to new one, end of song-related info
-
         #       if msg['context']['uri'] and ':collection' not in msg['context']['uri']:
         #           if msg['context']['uri'] not in Settings.value['Playlist Order']:  # If unknown
         #               self._update_playlists(msg['context']['uri'])  # Fetch new
@@ -486,7 +692,106 @@ class SpotifyWindow(WindowBase):
         #   self.value.update({'context': {'type': '', 'uri': ''}})
         #   self.debug("Set value context to None")
 
+    def _on_cover(self, state: dict) -> None:
+        cover_url = state['item']['album']['images'][0]['url']
+        if cover_url != self._response['item']['album']['images'][0]['url']:  # Load album cover (if changed)
+            self.log("Fetching album artwork", LogLevel.INF, data="url: " + cover_url)
+            self._cover_loader.request(cover_url, cover_url, self._load_cover,  # Replaces any older cover still loading
+                                       cached=self._load_cached_cover)
+            self._response['item']['album']['images'][0]['url'] = cover_url
+
+    def _on_device(self, state: dict) -> None:
+        self._response['device'] = state['device']
+
+    def _on_song(self, state: dict) -> None:  # Song name, album name, duration etc...
+        self._response['item']['name'] = self._shorten_name(state['item']['name'])
+        self._response['item']['album']['name'] = self._shorten_name(state['item']['album']['name'])
+        self._response['item']['duration_ms'] = int(state['item']['duration_ms'])
+        self._duration_ms = self._response['item']['duration_ms']
+        self._duration = self._convert_seconds(self._duration_ms // 1000)
+
+    def _on_progress(self, state: dict) -> None:
+        self._response['progress_ms'] = int(state['progress_ms'])
+        self._progress_ms = self._response['progress_ms']
+        self._progress = self._convert_seconds(self._progress_ms // 1000)
+
+    def _on_artists(self, state: dict) -> None:
+        self._response['item']['artists'] = state['item']['artists']  # Copy artist data to response (not shown directly)
+        self._artists = ", ".join(artist['name'] for artist in self._response['item']['artists'])  # Show all with ", "
+
+    def _on_playing(self, state: dict) -> None:
+        self._response['is_playing'] = state['is_playing']
+        self._is_playing = self._response['is_playing']
+
+    def _on_shuffle(self, state: dict) -> None:
+        self._response['shuffle_state'] = state['shuffle_state']
+        self._is_shuffle = self._response['shuffle_state']
+
+    def _on_context(self, state: dict) -> None:
+        context = state.get('context')
+        if context is not None:
+            if context['type'] == 'playlist':
+                if self._current_playlist == -1:  # No active playlist
+                    self._find_current_playlist(context['uri'])
+                elif self._playlists[self._current_playlist]['uri'] == context['uri']:
+                    pass  # Song is already in current playlist
+                else:  # Active playlist, but doesn't match song
+                    self._find_current_playlist(context['uri'])
+                self._playlist_liked_songs = False
+            elif context['type'] == 'collection':
+                self._playlist_liked_songs = True
+                self._current_playlist = -1
+            else:
+                self._current_playlist = -1
+
+        self._response['context'] = context  # Update context to new
+
+    def _on_track(self, state: dict) -> None:  # New song is playing
+        self._liked_track = state['item']['id']
+        self._is_liked = self._liked_cache.get(self._liked_track)  # Shown with the song info if cached
+        if self._is_liked is None:  # Ask nodered if it is liked or not (takes a second or 2)
+            self._liked_thread = threading.Thread(name='spotify_fetch_liked', target=self._fetch_liked_song,
+                                                  args=(self._liked_track,))
+            self._liked_thread.start()
+
+        self._response['item']['id'] = self._liked_track  # Update current song to new one
+
+    def _load_cover(self, url: str, data: bytes) -> tuple[pg.surface.Surface, pg.surface.Surface]:
+        """
+        Decodes, scales and caches a downloaded album cover (run by the cover loader thread)
+        :param url: The url of the album cover
+        :param data: The downloaded image
+        :return: The album cover and background surfaces
+        """
+        screen_size = self._Ui.Width if self._Ui.Width > self._Ui.Height else self._Ui.Height  # Get largest screen dimension (1:1 image)
+        image = pg.transform.smoothscale(pg.image.load(io.BytesIO(data)), (screen_size, screen_size))
+        cover = pg.transform.smoothscale(image, self._rect['album_cover'].size)  # Scale image to album cover
+
+        background = pg.surface.Surface((self._Ui.Width, self._Ui.Height))  # Create surf of screen size (efficient)
+        if not self._guideline_mode:  # Show image as bg
+            background.blit(image, (self._Ui.Center[0] - image.get_rect().center[0],
+                self._Ui.Center[1] - image.get_rect().center[1]))  # Blit image to screen (centered)
+        else:  # Show most common colour
+            background.fill(image.get_at(image.get_rect().midleft))  # Set bg to colour of artwork at mid-left
+        background.set_alpha(80 if not self._guideline_mode else 100)  # Dim the background
+
+        self._cover_cache.put(url, {'cover': cover, 'background': background})
+        return cover, background
+
+    def _load_cached_cover(self, url: str) -> tuple[pg.surface.Surface, pg.surface.Surface] or None:
+        """
+        Loads an already scaled album cover from disk (run by the cover loader thread)
+        :param url: The url of the album cover
+        :return: The album cover and background surfaces, or None if not cached
+        """
+        return self._cover_cache.get(url, ('cover', 'background'))
+
     def _fetch_liked_song(self, track_id: str, state=None) -> None:
+        """
+        Requests (or sets) the liked state of a song, run on a thread
+        :param track_id: The id of the song
+        :param state: The liked state to set, or None to only request it
+        """
         try:  # Request data from Node-RED
             url = self._nodered_url + "/spotify/liked"
 
@@ -495,77 +800,126 @@ class SpotifyWindow(WindowBase):
                 params.update({"state": state})
 
             self.log("Requesting liked song state", LogLevel.INF, data="url: " + url + ", params: " + str(params))
-            response = requests.get(url, timeout=10, params=params)
+            response = self._Http.get(url, params=params)
 
         except Exception as err:
             self.handle(err, trace=False)
-            self._is_liked = None
+            self._liked_failed(track_id, state)
             self.log("Error fetching liked song state", LogLevel.WRN)
             return
 
         if response is not None and response.status_code == 200:  # Request succeeded
-            self._is_liked = json.load(io.BytesIO(response.content))[0]  # Extract result (true/false)
-            self.log("Liked song response: " + str(self._is_liked), LogLevel.INF,
+            liked = json.load(io.BytesIO(response.content))[0]  # Extract result (true/false)
+            self._liked_cache.put(track_id, liked)
+            if track_id == self._liked_track:  # Song has not changed since requesting
+                self._is_liked = liked
+                FrameScheduler.wake()  # Show the result
+            self.log("Liked song response: " + str(liked), LogLevel.INF,
                      data="code: " + str(response.status_code))  # Decode response
             return
 
         else:
-            self._is_liked = None
+            self._liked_failed(track_id, state)
             self.log("Liked song request failed", LogLevel.ERR, data="url: " + url)
             return
 
+    def _liked_failed(self, track_id: str, state=None) -> None:
+        self._liked_cache.invalidate(track_id)
+        if track_id == self._liked_track:
+            self._is_liked = None if state is None else not state  # Revert toggle
+            FrameScheduler.wake()
+
     def _fetch_playlists(self, uri=None) -> None:
-        self._Ui.show_info("Loading playlists", colour='Spotify', timeout=0)
+        if not self._playlists:  # Stored playlists are shown whilst refreshing
+            self._Ui.show_info("Loading playlists", colour='Spotify', timeout=0)
         try:  # Request data from Node-RED
             url = self._nodered_url + "/spotify/playlist"
 
             params = None
+            headers = self._playlists.get_headers()  # Only download if changed
             if uri is not None:
                 params = {"uri": uri}
+                headers = None
 
             self.log("Requesting playlists", LogLevel.INF, data="uri: " + str(uri) + "url: " + url)
-            response = requests.get(url, timeout=10, params=params)
+            response = self._Http.get(url, params=params, headers=headers)
 
         except Exception as err:
             self.handle(err, trace=False)
-            self._playlists = []
             self.log("Error fetching playlists", LogLevel.WRN, data="uri: " + str(uri))
-            self._Ui.show_info("Failed to load playlists", colour='Error')
+            if not self._playlists:
+                self._Ui.show_info("Failed to load playlists", colour='Error')
             return
 
-        if response is not None and response.status_code == 200:  # Request succeeded
-            content = json.load(io.BytesIO(response.content))  # Decode response
-            if "items" in content.keys():  # Multiple playlists
-                for playlist in content["items"]:
-                    self._playlists.append(playlist)  # Add results to playlists
-            else:  # Single playlist
-                self._playlists.append(content)  # Add result to existing playlists
-
-            self.log("Playlist response: " + (str(self._playlists) if type(content) == dict else f"[{len(content)}]"),
-                     LogLevel.INF, data="code: " + str(response.status_code) + "uri: " + str(uri))  # Output response
+        if response is not None and response.status_code == 304:  # Library has not changed
+            self.log("Playlists unchanged", LogLevel.INF, data="count: " + str(len(self._playlists)))
             self._Ui.clear_info()
+            return
+
+        elif response is not None and response.status_code == 200:  # Request succeeded
+            if uri is not None:  # Single playlist
+                self._playlists.add(json.load(io.BytesIO(response.content)))  # Add result to existing playlists
+                changed = True
+            else:  # Multiple playlists
+                changed = self._playlists.update(response.content, response.headers)
+
+            self.log("Playlist response: [%d]", LogLevel.INF, args=(len(self._playlists),),
+                     data=lambda: "code: " + str(response.status_code) + ", changed: " + str(changed) + ", uri: " + str(uri))
+            self._Ui.clear_info()
+            if not changed:
+                return
 
         else:
-            self._playlists = []
             self.log("Playlist request failed", LogLevel.ERR, data="uri: " + str(uri) + "url: " + url)
-            self._Ui.show_info("Failed to load playlists", colour='Error')
+            if not self._playlists:
+                self._Ui.show_info("Failed to load playlists", colour='Error')
             return
 
         if self._response['context'] is not None:  # If there is previous response, update to new playlists
             if self._response['context']['type'] == 'playlist':
                 self._find_current_playlist(self._response['context']['uri'])
 
+    def _draw_playlist_row(self, surf: pg.surface.Surface, index: int) -> None:
+        """
+        Draws a row of the playlist menu (cover is drawn separately from the atlas)
+        :param surf: The cleared row surface
+        :param index: The index of the playlist
+        """
+        surf.blit(*self._Ui.text(self._playlists[index]['name'], 30, bold=False, draw=False,
+                                 colour='Spotify' if index == self._current_playlist else 'White',
+                                 midleft=(self._thumbnail_size[0] + 25, surf.get_height() / 2)))
+
+    def _load_thumbnails(self, first: int, last: int) -> None:
+        """
+        Requests the covers of playlists that are about to be shown, dropping requests for any others
+        :param first: Index of the first playlist
+        :param last: Index after the last playlist
+        """
+        uris = set()
+        for index in range(max(first, 0), min(last, len(self._playlists))):
+            playlist = self._playlists[index]
+            uris.add(playlist['uri'])
+            if (playlist.get('images') and playlist['uri'] not in self._thumbnails and
+                    not self._thumbnail_loader.is_pending(playlist['uri'])):
+                # Smallest image is last, only needs scaling down to the thumbnail size
+                self._thumbnail_loader.request(playlist['uri'], playlist['images'][-1]['url'], self._load_thumbnail)
+        self._thumbnail_loader.retain(uris)
+
+    def _load_thumbnail(self, uri: str, data: bytes) -> pg.surface.Surface:
+        """
+        Decodes a downloaded playlist cover at the thumbnail size (run by the thumbnail loader thread)
+        :param uri: The uri of the playlist
+        :param data: The downloaded image
+        :return: The thumbnail
+        """
+        return pg.transform.smoothscale(pg.image.load(io.BytesIO(data)), self._thumbnail_size)
+
     def _find_current_playlist(self, uri: str) -> None:
-        self.log("Finding playlist", LogLevel.INF, data="uri: " + uri)
-        # Check if new playlist is in self._playlists
-        for index in range(0, len(self._playlists)):
-            if self._playlists[index]['uri'] == uri:
-                self._current_playlist = index
-                self.log("Found current playlist at index " + str(self._current_playlist), LogLevel.INF,
-                         data="name: \"" + self._playlists[self._current_playlist]['name'] + "\"")
-                break
+        self._current_playlist = self._playlists.index(uri)  # Check if new playlist is in self._playlists
+        if self._current_playlist > -1:
+            self.log("Found current playlist at index " + str(self._current_playlist), LogLevel.INF,
+                     data="name: \"" + self._playlists[self._current_playlist]['name'] + "\"")
         else:
-            self._current_playlist = -1
             self.log("Could not find current playlist", LogLevel.INF, data="uri: " + uri)
 
     @staticmethod